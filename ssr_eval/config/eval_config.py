@@ -1,6 +1,24 @@
 import toml
 from pydantic import BaseModel
-from typing import List, Dict, Union
+from typing import List, Union, Optional
+
+
+class DsmTifOptions(BaseModel):
+    # Creation options of the DSM tif files (keyword arguments of
+    # write_dsm_tif, see get_tif_creation_options). The typed fields avoid
+    # that pydantic converts e.g. bigtiff = "YES" to a bool.
+    tiled: bool = False
+    block_size: int = 256
+    # None, "DEFLATE", "LZW" or "ZSTD"
+    compress: Optional[str] = None
+    # None, "YES", "NO", "IF_NEEDED" or "IF_SAFER"
+    bigtiff: Optional[str] = None
+    overviews: bool = False
+    cog: bool = False
+
+    class Config:
+        # report misspelled options instead of ignoring them
+        extra = "forbid"
 
 
 class EvalConfig(BaseModel):
@@ -19,6 +37,56 @@ class EvalConfig(BaseModel):
     odp: str
 
     check_output_name_correctness: Union[bool, int] = 1
+    # Skip meshes whose results (see manifest.json in the output directory)
+    # match the current inputs and parameters, recompute the others
+    incremental: Union[bool, int] = 0
+
+    # Number of processes used to align the reconstructed and the ground
+    # truth DSM. The worker processes are shared by all evaluated meshes.
+    max_processes: int = 16
+    # Number of meshes evaluated concurrently. The max_processes cores are
+    # split between the meshes (i.e. each mesh uses
+    # max_processes // max_parallel_meshes alignment worker processes).
+    max_parallel_meshes: int = 1
+    # Possible values: "exhaustive", "pyramid" (coarse-to-fine) or "pruned"
+    alignment_search_mode: str = "exhaustive"
+    # Possible values: "manager" or "shared_memory"
+    alignment_worker_backend: str = "shared_memory"
+    # Maximum alignment shift in cells (30 cells correspond to 15 meters)
+    alignment_search_radius: int = 30
+    # Padding of the ground truth DSM in cells, defaults to radius + 10
+    alignment_pad_width: Optional[int] = None
+    # Start with a small search window and widen it only if necessary
+    alignment_adaptive_search: Union[bool, int] = 0
+    # Refine the integer alignment shift to subpixel precision
+    alignment_subpixel_refinement: Union[bool, int] = 0
+
+    # Process the (sampled) point clouds in chunks of the given number of
+    # points instead of loading them completely
+    stream_chunk_size: Optional[int] = None
+    # Produce the DSM in tiles of the given size (in cells) in parallel
+    # (using the max_processes worker processes)
+    dsm_tile_size: Optional[int] = None
+    # Creation options of the DSM tif files (see DsmTifOptions)
+    dsm_tif_options: DsmTifOptions = DsmTifOptions()
+
+    # Directory used to store the ground truth height maps as .npy files
+    # (reused by later runs as long as the ground truth tif is unchanged)
+    ground_truth_cache_dp: Optional[str] = None
+    # Directory used to store the (sampled) point clouds converted to UTM
+    # coordinates as .npy files (reused for identical ply / aoi.json files)
+    utm_point_cache_dp: Optional[str] = None
+    # Least recently used entries are removed above this size (in GB)
+    utm_point_cache_max_size_gb: float = 10.0
+
+    # Directory used to store the point clouds sampled with Meshlab (reused
+    # for identical meshes, sampling methods, sample counts and seeds)
+    sample_cache_dp: Optional[str] = None
+    # Least recently used entries are removed above this size (in GB)
+    sample_cache_max_size_gb: float = 50.0
+    # Identifies the sampling run in the sample cache (change it to obtain a
+    # new sample)
+    sampling_seed: int = 0
 
     @classmethod
     def get_from_file(cls, toml_ifp):
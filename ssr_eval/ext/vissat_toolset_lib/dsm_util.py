@@ -14,31 +14,13 @@ def _parse_proj_str(proj_str):
     return zone_number, hemisphere
 
 
-def read_dsm_tif(file):
-    assert os.path.exists(file)
-
-    ds = gdal.Open(file)
+def _get_meta_dict(ds):
     geo = ds.GetGeoTransform()
     proj = ds.GetProjection()
     meta = ds.GetMetadata()
     width = ds.RasterXSize
     height = ds.RasterYSize
 
-    assert ds.RasterCount == 1  # dsm is only one band
-    band = ds.GetRasterBand(1)  # band index is one-based
-
-    data_type = gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType)
-    assert isinstance(data_type(), np.float32)
-    image = np.zeros((ds.RasterYSize, ds.RasterXSize), dtype=np.float32)
-
-    image[:, :] = band.ReadAsArray()
-    nodata = band.GetNoDataValue()
-
-    # to ease later processing, replace nodata regions with nan
-    if nodata is not None:
-        mask = np.isclose(image, nodata)
-        image[mask] = np.nan
-
     zone_number, hemisphere = _parse_proj_str(proj)
     # return a meta dict
     meta_dict = {
@@ -47,7 +29,7 @@ def read_dsm_tif(file):
         "meta": meta,
         "img_width": width,
         "img_height": height,
-        "nodata": nodata,
+        "nodata": ds.GetRasterBand(1).GetNoDataValue(),
         "zone_number": zone_number,
         "hemisphere": hemisphere,
         "ul_easting": geo[0],
@@ -71,6 +53,48 @@ def read_dsm_tif(file):
     meta_dict["area_height"] = (
         meta_dict["ul_northing"] - meta_dict["lr_northing"]
     )
+    return meta_dict
+
+
+def _read_band_window(band, xoff, yoff, xsize, ysize):
+    data_type = gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType)
+    assert isinstance(data_type(), np.float32)
+    image = np.zeros((ysize, xsize), dtype=np.float32)
+
+    # Tiled files are read one row of tiles at a time (i.e. each tile is
+    # decoded once), directly into the (contiguous) rows of image
+    block_width, block_height = band.GetBlockSize()
+    if block_width < band.XSize:
+        rows_per_read = block_height
+    else:
+        rows_per_read = ysize
+    for row in range(0, ysize, rows_per_read):
+        num_rows = min(rows_per_read, ysize - row)
+        band.ReadAsArray(
+            xoff,
+            yoff + row,
+            xsize,
+            num_rows,
+            buf_obj=image[row : row + num_rows],
+        )
+    nodata = band.GetNoDataValue()
+
+    # to ease later processing, replace nodata regions with nan
+    if nodata is not None:
+        mask = np.isclose(image, nodata)
+        image[mask] = np.nan
+    return image
+
+
+def read_dsm_tif(file):
+    assert os.path.exists(file)
+
+    ds = gdal.Open(file)
+    assert ds.RasterCount == 1  # dsm is only one band
+    band = ds.GetRasterBand(1)  # band index is one-based
+
+    image = _read_band_window(band, 0, 0, ds.RasterXSize, ds.RasterYSize)
+    meta_dict = _get_meta_dict(ds)
     meta_dict["alt_min"] = float(np.nanmin(image))  # for json serialization
     meta_dict["alt_max"] = float(np.nanmax(image))
 
@@ -78,6 +102,50 @@ def read_dsm_tif(file):
     return image, meta_dict
 
 
+# returns the meta dict of read_dsm_tif (without alt_min and alt_max) without
+# reading the raster data
+def read_dsm_tif_meta(file):
+    assert os.path.exists(file)
+
+    ds = gdal.Open(file)
+    assert ds.RasterCount == 1  # dsm is only one band
+    meta_dict = _get_meta_dict(ds)
+    del ds
+    return meta_dict
+
+
+# Reads the window with the upper left pixel (col_off, row_off) and the size
+# (width, height). The window may lie partially (or completely) outside of
+# the raster, such cells are set to nan. Only the overlapping part is read.
+def read_dsm_tif_window(file, col_off, row_off, width, height):
+    assert os.path.exists(file)
+
+    ds = gdal.Open(file)
+    assert ds.RasterCount == 1  # dsm is only one band
+    band = ds.GetRasterBand(1)  # band index is one-based
+
+    image = np.full((height, width), np.nan, dtype=np.float32)
+    col_start = max(col_off, 0)
+    row_start = max(row_off, 0)
+    col_end = min(col_off + width, ds.RasterXSize)
+    row_end = min(row_off + height, ds.RasterYSize)
+    if col_start < col_end and row_start < row_end:
+        image[
+            row_start - row_off : row_end - row_off,
+            col_start - col_off : col_end - col_off,
+        ] = _read_band_window(
+            band,
+            col_start,
+            row_start,
+            col_end - col_start,
+            row_end - row_start,
+        )
+    meta_dict = _get_meta_dict(ds)
+
+    del ds
+    return image, meta_dict
+
+
 def get_driver(file):
     f_ext = os.path.splitext(file)[1]
     for i in range(gdal.GetDriverCount()):
@@ -91,10 +159,57 @@ def get_driver(file):
     return None
 
 
+def get_tif_creation_options(
+    tiled=False, block_size=256, compress=None, bigtiff=None
+):
+    # compress: None, "DEFLATE", "LZW" or "ZSTD" (uses the floating point
+    #   predictor)
+    # bigtiff: None, "YES", "NO", "IF_NEEDED" or "IF_SAFER"
+    options = []
+    if tiled:
+        options += [
+            "TILED=YES",
+            f"BLOCKXSIZE={block_size}",
+            f"BLOCKYSIZE={block_size}",
+        ]
+    if compress is not None:
+        assert compress.upper() in ["DEFLATE", "LZW", "ZSTD"]
+        options += [f"COMPRESS={compress.upper()}", "PREDICTOR=3"]
+    if bigtiff is not None:
+        options.append(f"BIGTIFF={bigtiff.upper()}")
+    return options
+
+
+def _get_overview_factors(width, height, block_size):
+    # factors 2, 4, 8, ... until the overview fits into a single block
+    factors = []
+    factor = 2
+    while max(width, height) / (factor / 2) > block_size:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
 # out_file: .tif file to write
 # geo: (ul_e, ul_n, e_resolution, n_resolution)
 # utm_zone: ('N' or 'S')
-def write_dsm_tif(image, out_file, geo, utm_zone, nodata_val=None):
+# tiled, block_size, compress, bigtiff: see get_tif_creation_options
+# overviews: add (nearest neighbor) overviews
+# cog: write a cloud optimized GeoTIFF (i.e. tiled, with the overviews
+#   stored before the full resolution data)
+def write_dsm_tif(
+    image,
+    out_file,
+    geo,
+    utm_zone,
+    nodata_val=None,
+    tiled=False,
+    block_size=256,
+    compress=None,
+    bigtiff=None,
+    overviews=False,
+    cog=False,
+):
     assert len(image.shape) == 2  # image should only be 2D
 
     ul_e, ul_n, e_resolution, n_resolution = geo
@@ -107,13 +222,25 @@ def write_dsm_tif(image, out_file, geo, utm_zone, nodata_val=None):
     else:
         nodata_val = np.nan
 
-    driver = get_driver(out_file)
+    if cog:
+        # The COG driver only supports CreateCopy, i.e. the dsm is created
+        # in memory first
+        driver = gdal.GetDriverByName("MEM")
+        out_fp = ""
+        options = []
+    else:
+        driver = get_driver(out_file)
+        out_fp = out_file
+        options = get_tif_creation_options(
+            tiled, block_size, compress, bigtiff
+        )
     out = driver.Create(
-        out_file,
+        out_fp,
         image.shape[1],
         image.shape[0],
         1,
         gdal_array.NumericTypeCodeToGDALTypeCode(np.float32),
+        options=options,
     )
     band = out.GetRasterBand(1)  # one-based index
     band.WriteArray(image.astype(np.float32), 0, 0)
@@ -136,4 +263,24 @@ def write_dsm_tif(image, out_file, geo, utm_zone, nodata_val=None):
     out.SetProjection(srs.ExportToWkt())
     out.SetMetadata({"AREA_OR_POINT": "Area"})
 
+    if cog:
+        cog_options = [
+            f"BLOCKSIZE={block_size}",
+            "OVERVIEWS=AUTO" if overviews else "OVERVIEWS=NONE",
+            "RESAMPLING=NEAREST",
+        ]
+        if compress is not None:
+            assert compress.upper() in ["DEFLATE", "LZW", "ZSTD"]
+            cog_options += [f"COMPRESS={compress.upper()}", "PREDICTOR=YES"]
+        if bigtiff is not None:
+            cog_options.append(f"BIGTIFF={bigtiff.upper()}")
+        gdal.GetDriverByName("COG").CreateCopy(
+            out_file, out, options=cog_options
+        )
+    elif overviews:
+        out.BuildOverviews(
+            "NEAREST",
+            _get_overview_factors(image.shape[1], image.shape[0], block_size),
+        )
+
     del out
@@ -0,0 +1,103 @@
+import os
+import json
+import functools
+import numpy as np
+import pyproj
+
+# WGS84 ellipsoid (also used by pymap3d and the UTM projection)
+WGS84_A = 6378137.0
+WGS84_F = 1.0 / 298.257223563
+WGS84_E2 = WGS84_F * (2.0 - WGS84_F)
+
+
+def _geodetic_to_ecef(lat, lon, alt):
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    n = WGS84_A / np.sqrt(1.0 - WGS84_E2 * np.sin(lat) ** 2)
+    x = (n + alt) * np.cos(lat) * np.cos(lon)
+    y = (n + alt) * np.cos(lat) * np.sin(lon)
+    z = (n * (1.0 - WGS84_E2) + alt) * np.sin(lat)
+    return np.array([x, y, z])
+
+
+class EnuUtmTransformer:
+    """
+    Transforms (N, 3) arrays of local ENU coordinates (w.r.t. the origin
+    lat0, lon0, alt0) to (UTM east, UTM north, altitude) and back.
+
+    ENU <-> ECEF is a rigid transformation, whose rotation matrix and
+    translation are computed once. ECEF <-> UTM is performed with a single
+    pyproj pipeline (i.e. without an intermediate lat / lon array). All
+    points must lie in the given UTM zone and hemisphere.
+    """
+
+    def __init__(self, lat0, lon0, alt0, zone_number, hemisphere):
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.alt0 = alt0
+        self.zone_number = zone_number
+        self.hemisphere = hemisphere
+
+        sin_lat = np.sin(np.radians(lat0))
+        cos_lat = np.cos(np.radians(lat0))
+        sin_lon = np.sin(np.radians(lon0))
+        cos_lon = np.cos(np.radians(lon0))
+        # the columns are the east, north and up axes in ECEF coordinates
+        self._rotation = np.array(
+            [
+                [-sin_lon, -sin_lat * cos_lon, cos_lat * cos_lon],
+                [cos_lon, -sin_lat * sin_lon, cos_lat * sin_lon],
+                [0.0, cos_lat, sin_lat],
+            ]
+        )
+        self._origin = _geodetic_to_ecef(lat0, lon0, alt0)
+
+        south = " +south" if hemisphere == "S" else ""
+        self._ecef_to_utm = pyproj.Transformer.from_pipeline(
+            "+proj=pipeline"
+            " +step +inv +proj=cart +ellps=WGS84"
+            f" +step +proj=utm +zone={zone_number}{south} +ellps=WGS84"
+        )
+
+    @classmethod
+    def from_aoi(cls, bbx):
+        # bbx: content of the aoi.json file of a site
+        lat0 = (bbx["lat_min"] + bbx["lat_max"]) / 2.0
+        lon0 = (bbx["lon_min"] + bbx["lon_max"]) / 2.0
+        alt0 = bbx["alt_min"]
+        return cls(lat0, lon0, alt0, bbx["zone_number"], bbx["hemisphere"])
+
+    def enu_to_utm(self, points):
+        points = np.asarray(points, dtype=np.float64)
+        ecef = points @ self._rotation.T + self._origin
+        east, north, alt = self._ecef_to_utm.transform(
+            np.ascontiguousarray(ecef[:, 0]),
+            np.ascontiguousarray(ecef[:, 1]),
+            np.ascontiguousarray(ecef[:, 2]),
+        )
+        return np.column_stack((east, north, alt))
+
+    def utm_to_enu(self, points):
+        points = np.asarray(points, dtype=np.float64)
+        x, y, z = self._ecef_to_utm.transform(
+            np.ascontiguousarray(points[:, 0]),
+            np.ascontiguousarray(points[:, 1]),
+            np.ascontiguousarray(points[:, 2]),
+            direction="INVERSE",
+        )
+        ecef = np.column_stack((x, y, z))
+        return (ecef - self._origin) @ self._rotation
+
+
+@functools.lru_cache(maxsize=8)
+def _load_enu_utm_transformer(aoi_fp, aoi_mtime):
+    with open(aoi_fp) as fp:
+        bbx = json.load(fp)
+    return EnuUtmTransformer.from_aoi(bbx)
+
+
+def get_enu_utm_transformer(site_data_dir):
+    # The transformer is created once per site (i.e. per aoi.json file) and
+    # reused for all meshes / point clouds of the site
+    aoi_fp = os.path.join(site_data_dir, "aoi.json")
+    return _load_enu_utm_transformer(aoi_fp, os.path.getmtime(aoi_fp))
@@ -1,69 +1,224 @@
-from .plyfile import PlyData, PlyElement
+from .plyfile import (
+    PlyData,
+    PlyElement,
+    PlyProperty,
+    PlyListProperty,
+    PlyParseError,
+)
 import numpy as np
 
 
-# only support writing vertex and color attributes
-def np2ply(
-    vertex, out_ply, color=None, comments=None, text=False, use_double=False
-):
+def _get_vertex_dtype(use_double, with_color, with_normal, attributes):
+    # little endian dtype of the vertex element (i.e. the in-memory layout is
+    # identical to the binary file layout)
     if use_double:
-        vertex = vertex.astype(dtype=np.float64)
-        dtype_list = [("x", "f8"), ("y", "f8"), ("z", "f8")]
+        dtype_list = [("x", "<f8"), ("y", "<f8"), ("z", "<f8")]
     else:
-        vertex = vertex.astype(dtype=np.float32)
-        dtype_list = [("x", "f4"), ("y", "f4"), ("z", "f4")]
-
-    if color is None:
-        data = [
-            (vertex[i, 0], vertex[i, 1], vertex[i, 2])
-            for i in range(vertex.shape[0])
-        ]
-    else:
-        data = [
-            (
-                vertex[i, 0],
-                vertex[i, 1],
-                vertex[i, 2],
-                color[i, 0],
-                color[i, 1],
-                color[i, 2],
-            )
-            for i in range(vertex.shape[0])
-        ]
-        dtype_list = dtype_list + [
-            ("red", "uint8"),
-            ("green", "uint8"),
-            ("blue", "uint8"),
+        dtype_list = [("x", "<f4"), ("y", "<f4"), ("z", "<f4")]
+    if with_color:
+        dtype_list += [("red", "u1"), ("green", "u1"), ("blue", "u1")]
+    if with_normal:
+        normal_type = dtype_list[0][1]
+        dtype_list += [
+            ("nx", normal_type),
+            ("ny", normal_type),
+            ("nz", normal_type),
         ]
+    for name, values in attributes.items():
+        dtype_list.append((name, np.dtype(values.dtype).newbyteorder("<")))
+    return np.dtype(dtype_list)
 
-    vertex = np.array(data, dtype=dtype_list)
-    el = PlyElement.describe(vertex, "vertex")
-    if text:
-        text_fmt = ["%.4f", "%.4f", "%.4f"]
-        if color is not None:
-            text_fmt = text_fmt + ["%i", "%i", "%i"]
 
-        if comments is None:
-            PlyData([el], text=True, text_fmt=text_fmt).write(out_ply)
-        else:
-            PlyData(
-                [el], text=True, text_fmt=text_fmt, comments=comments
-            ).write(out_ply)
+def _fill_vertex_data(vertex_data, vertex, color, normal, attributes):
+    # fill the structured array column by column
+    vertex_data["x"] = vertex[:, 0]
+    vertex_data["y"] = vertex[:, 1]
+    vertex_data["z"] = vertex[:, 2]
+    if color is not None:
+        vertex_data["red"] = color[:, 0]
+        vertex_data["green"] = color[:, 1]
+        vertex_data["blue"] = color[:, 2]
+    if normal is not None:
+        vertex_data["nx"] = normal[:, 0]
+        vertex_data["ny"] = normal[:, 1]
+        vertex_data["nz"] = normal[:, 2]
+    for name, values in attributes.items():
+        vertex_data[name] = values
+
+
+def _get_vertex_element(vertex, color, normal, attributes, use_double):
+    if attributes is None:
+        attributes = {}
+    dtype = _get_vertex_dtype(
+        use_double, color is not None, normal is not None, attributes
+    )
+    vertex_data = np.empty(vertex.shape[0], dtype=dtype)
+    _fill_vertex_data(vertex_data, vertex, color, normal, attributes)
+    return PlyElement.describe(vertex_data, "vertex")
+
+
+# only support writing vertex, color, normal and (scalar) vertex attributes
+def np2ply(
+    vertex,
+    out_ply,
+    color=None,
+    comments=None,
+    text=False,
+    use_double=False,
+    normal=None,
+    attributes=None,
+):
+    # out_ply: file name or binary file handle (the data is written directly
+    #   to the handle)
+    # normal: (N, 3) array of surface normals
+    # attributes: dict mapping property names to (N,) arrays (e.g. errors)
+    el = _get_vertex_element(vertex, color, normal, attributes, use_double)
+    if comments is None:
+        comments = []
+    if text:
+        PlyData([el], text=True, comments=comments).write(out_ply)
     else:
-        if comments is None:
-            PlyData([el], byte_order="<").write(out_ply)
-        else:
-            PlyData([el], byte_order="<", comments=comments).write(out_ply)
+        PlyData([el], byte_order="<", comments=comments).write(out_ply)
 
 
 # not support surface normal
 def ply2np(in_ply):
-    ply = PlyData.read(in_ply)
+    # the vertex data is mapped (not loaded), only xyz and rgb are copied
+    ply = PlyData.read(in_ply, mmap="r")
+    comments = ply.comments
+    if len(comments) == 0:
+        comments = None
+
+    vertex = ply["vertex"].data
+    xyz, rgb = _vertex_to_xyz_rgb(vertex)
+
+    return xyz, rgb, comments
+
+
+def _get_faces(face_element):
+    prop_names = [prop.name for prop in face_element.properties]
+    if "vertex_indices" in prop_names:
+        name = "vertex_indices"
+    else:
+        name = "vertex_index"
+    if face_element.count == 0:
+        return np.empty((0, 3), dtype=np.int64)
+    # binary files with fixed length lists (e.g. triangles) are decoded into
+    # a 2-D array, i.e. no array per face is created
+    vertex_indices = face_element.fixed_list(name)
+    if vertex_indices is None:
+        vertex_indices = np.vstack(face_element.data[name])
+    return vertex_indices.astype(np.int64)
+
+
+def read_ply_arrays(in_ply, with_color=True, with_faces=False):
+    """
+    Loads a point cloud or mesh directly into numpy arrays.
+
+    Returns (xyz, color, faces, comments), where xyz is a contiguous (N, 3)
+    array, color a (N, 3) uint8 array (None, if with_color is False or the
+    file contains no colors) and faces a (M, K) array of vertex indices
+    (None, if with_faces is False or the file contains no faces). The
+    vertex data is mapped (see PlyData.read), so only the requested
+    columns are copied.
+    """
+    ply = PlyData.read(in_ply, mmap="r")
     comments = ply.comments
     if len(comments) == 0:
         comments = None
 
     vertex = ply["vertex"].data
+    xyz = get_vertex_columns(vertex, ["x", "y", "z"])
+    color = None
+    if with_color and "red" in vertex.dtype.names:
+        color = get_vertex_columns(vertex, ["red", "green", "blue"])
+    faces = None
+    if with_faces and "face" in ply:
+        faces = _get_faces(ply["face"])
+
+    return xyz, color, faces, comments
+
+
+def write_ply_arrays(
+    out_ply,
+    xyz,
+    color=None,
+    faces=None,
+    comments=None,
+    use_double=False,
+    normal=None,
+    attributes=None,
+):
+    # Counterpart of read_ply_arrays (writes a binary little endian file).
+    # See np2ply for normal and attributes.
+    elements = [
+        _get_vertex_element(xyz, color, normal, attributes, use_double)
+    ]
+    if faces is not None:
+        face_data = np.empty(
+            faces.shape[0], dtype=[("vertex_indices", "<i4", faces.shape[1:])]
+        )
+        face_data["vertex_indices"] = faces
+        elements.append(PlyElement.describe(face_data, "face"))
+    if comments is None:
+        comments = []
+    PlyData(elements, byte_order="<", comments=comments).write(out_ply)
+
+
+# only support triangle meshes
+def ply2np_mesh(in_ply):
+    xyz, _, faces, comments = read_ply_arrays(
+        in_ply, with_color=False, with_faces=True
+    )
+    assert faces is not None, "No faces found"
+    assert faces.shape[1] == 3, "Only triangle meshes are supported"
+    return xyz, faces, comments
+
+
+def get_ply_schema(in_ply):
+    # Returns {element_name: (count, [(property_name, dtype), ...])} by
+    # parsing only the header (i.e. without reading any data). The dtype of
+    # a list property is the pair (len_dtype, val_dtype).
+    with open(in_ply, "rb") as stream:
+        ply = PlyData._parse_header(stream)
+    schema = {}
+    for element in ply.elements:
+        properties = []
+        for prop in element.properties:
+            if isinstance(prop, PlyListProperty):
+                properties.append((prop.name, prop.list_dtype(ply.byte_order)))
+            else:
+                properties.append((prop.name, prop.dtype(ply.byte_order)))
+        schema[element.name] = (element.count, properties)
+    return schema
+
+
+def get_ply_num_vertices(in_ply):
+    with open(in_ply, "rb") as stream:
+        ply = PlyData._parse_header(stream)
+    return ply["vertex"].count
+
+
+def get_vertex_columns(vertex, names, dtype=None):
+    # Copies the given fields of a structured vertex array (e.g. a memmap)
+    # into a contiguous (N, len(names)) array without touching the other
+    # fields
+    if dtype is None:
+        dtype = np.result_type(*[vertex.dtype[name] for name in names])
+    columns = np.empty((vertex.shape[0], len(names)), dtype=dtype)
+    for idx, name in enumerate(names):
+        columns[:, idx] = vertex[name]
+    return columns
+
+
+# returns only the vertex coordinates as contiguous (N, 3) array
+def ply2np_xyz(in_ply, dtype=None):
+    ply = PlyData.read(in_ply, mmap="r")
+    vertex = ply["vertex"].data
+    return get_vertex_columns(vertex, ["x", "y", "z"], dtype=dtype)
+
+
+def _vertex_to_xyz_rgb(vertex):
     names = vertex.dtype.names
 
     if "x" in names:
@@ -86,4 +241,117 @@ def ply2np(in_ply):
     else:
         rgb = None
 
-    return xyz, rgb, comments
+    return xyz, rgb
+
+
+class PlyVertexChunkReader:
+    """
+    Reads the vertices of a binary ply file in chunks of chunk_size vertices
+    (i.e. without loading the whole file). Iterating over the reader yields
+    (xyz, rgb) tuples like ply2np (rgb is None, if there are no colors).
+
+    The vertex element must be the first element of the file and must not
+    contain list properties.
+    """
+
+    def __init__(self, in_ply, chunk_size):
+        self.in_ply = in_ply
+        self.chunk_size = chunk_size
+        with open(in_ply, "rb") as stream:
+            ply = PlyData._parse_header(stream)
+        self._check_layout(ply)
+        vertex_element = ply.elements[0]
+        self.num_vertices = vertex_element.count
+        self.has_color = "red" in vertex_element._property_lookup
+        self.comments = ply.comments
+
+    @staticmethod
+    def _check_layout(ply):
+        assert not ply.text, "Only binary ply files can be read in chunks"
+        assert len(ply.elements) > 0 and ply.elements[0].name == "vertex"
+        assert not ply.elements[0]._have_list
+
+    def __iter__(self):
+        with open(self.in_ply, "rb") as stream:
+            ply = PlyData._parse_header(stream)
+            vertex_element = ply.elements[0]
+            dtype = vertex_element.dtype(ply.byte_order)
+            num_read = 0
+            while num_read < vertex_element.count:
+                num_chunk = min(
+                    self.chunk_size, vertex_element.count - num_read
+                )
+                vertex = np.fromfile(stream, dtype, num_chunk)
+                if len(vertex) < num_chunk:
+                    raise PlyParseError(
+                        "early end-of-file",
+                        vertex_element,
+                        num_read + len(vertex),
+                    )
+                num_read += num_chunk
+                yield _vertex_to_xyz_rgb(vertex)
+
+
+class PlyVertexChunkWriter:
+    """
+    Writes num_vertices vertices (and optionally colors) to a binary ply
+    file in chunks. The header is written on construction, write() must be
+    called until exactly num_vertices vertices have been written.
+    """
+
+    def __init__(
+        self,
+        out_ply,
+        num_vertices,
+        with_color=False,
+        comments=None,
+        use_double=False,
+    ):
+        self.num_vertices = num_vertices
+        self.with_color = with_color
+        self._num_written = 0
+        self._dtype = _get_vertex_dtype(use_double, with_color, False, {})
+
+        properties = [
+            PlyProperty(name, self._dtype[name].str[1:])
+            for name in self._dtype.names
+        ]
+        el = PlyElement("vertex", properties, num_vertices)
+        if comments is None:
+            comments = []
+        ply = PlyData([el], byte_order="<", comments=comments)
+        self._stream = open(out_ply, "wb")
+        self._stream.write(ply.header.encode("ascii"))
+        self._stream.write(b"\n")
+
+    def write(self, vertex, color=None):
+        vertex_data = np.empty(vertex.shape[0], dtype=self._dtype)
+        if not self.with_color:
+            color = None
+        _fill_vertex_data(vertex_data, vertex, color, None, {})
+        vertex_data.tofile(self._stream)
+        self._num_written += vertex.shape[0]
+
+    def close(self):
+        self._stream.close()
+        assert self._num_written == self.num_vertices
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._stream.close()
+
+
+def transform_vertex_chunks(ply_reader, ply_writer, transform_func):
+    # Yields transform_func(xyz) for each chunk of the PlyVertexChunkReader
+    # and writes the transformed chunk (and its colors) to the
+    # PlyVertexChunkWriter, e.g. to convert a point cloud to UTM
+    # coordinates while producing its dsm chunk by chunk
+    for xyz, rgb in ply_reader:
+        xyz = transform_func(xyz)
+        ply_writer.write(xyz, rgb)
+        yield xyz
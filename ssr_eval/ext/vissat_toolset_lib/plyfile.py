@@ -74,6 +74,14 @@ _byte_order_reverse = {"<": "binary_little_endian", ">": "binary_big_endian"}
 _native_byte_order = {"little": "<", "big": ">"}[_byteorder]
 
 
+def _can_mmap(stream):
+    try:
+        stream.fileno()
+        return True
+    except Exception:
+        return False
+
+
 def _lookup_type(type_str):
     if type_str not in _data_type_reverse:
         try:
@@ -278,11 +286,20 @@ class PlyData(object):
         )
 
     @staticmethod
-    def read(stream):
+    def read(stream, mmap=False):
         """
         Read PLY data from a readable file-like object or filename.
 
+        mmap: if not False, elements without list properties of binary
+            files are returned as np.memmap views of the file (instead
+            of being loaded into memory).  True is equivalent to 'c'
+            (copy-on-write), other valid values are 'r' and 'r+' (see
+            np.memmap).  Ignored for text files and streams without a
+            file descriptor.
+
         """
+        if mmap is True:
+            mmap = "c"
         must_close = False
         try:
             if isinstance(stream, str):
@@ -292,7 +309,7 @@ class PlyData(object):
             data = PlyData._parse_header(stream)
 
             for elt in data:
-                elt._read(stream, data.text, data.byte_order)
+                elt._read(stream, data.text, data.byte_order, mmap)
 
         finally:
             if must_close:
@@ -413,16 +430,33 @@ class PlyElement(object):
             isinstance(p, PlyListProperty) for p in self.properties
         )
 
+        # (count, n) arrays of the list properties decoded by
+        # _read_bin_fixed_lists, see fixed_list()
+        self._fixed_lists = {}
+        # names of the list properties whose (object) column of data has
+        # not been created yet
+        self._pending_lists = []
+
     @property
     def count(self):
         return self._count
 
     def _get_data(self):
+        # The object columns of the fixed length lists are only created if
+        # the data is accessed (which requires one array per record)
+        for name in self._pending_lists:
+            values = self._fixed_lists[name]
+            self._data[name] = _np.fromiter(
+                values, dtype=object, count=len(values)
+            )
+        self._pending_lists = []
         return self._data
 
     def _set_data(self, data):
         self._data = data
         self._count = len(data)
+        self._fixed_lists = {}
+        self._pending_lists = []
         self._check_sanity()
 
     data = property(_get_data, _set_data)
@@ -442,6 +476,15 @@ class PlyElement(object):
 
     properties = property(_get_properties, _set_properties)
 
+    def fixed_list(self, name):
+        """
+        Return the values of the list property name as (count, n) array,
+        if they have been read from a binary file and all lists have the
+        same length n (e.g. triangle faces).  Otherwise, return None.
+
+        """
+        return self._fixed_lists.get(name)
+
     def _index(self):
         self._property_lookup = dict(
             (prop.name, prop) for prop in self._properties
@@ -581,7 +624,7 @@ class PlyElement(object):
 
         return elt
 
-    def _read(self, stream, text, byte_order):
+    def _read(self, stream, text, byte_order, mmap=False):
         """
         Read the actual data from a PLY file.
 
@@ -593,6 +636,21 @@ class PlyElement(object):
                 # There are list properties, so a simple load is
                 # impossible.
                 self._read_bin(stream, byte_order)
+            elif mmap and _can_mmap(stream):
+                # The byte offset of the element is the current stream
+                # position, so the data can be mapped without reading it.
+                dtype = _np.dtype(self.dtype(byte_order))
+                offset = stream.tell()
+                stream.seek(0, 2)
+                num_bytes = stream.tell() - offset
+                if num_bytes < self.count * dtype.itemsize:
+                    raise PlyParseError(
+                        "early end-of-file", self, num_bytes // dtype.itemsize
+                    )
+                self._data = _np.memmap(
+                    stream, dtype, mmap, offset, (self.count,)
+                )
+                stream.seek(offset + self.count * dtype.itemsize)
             else:
                 # There are no list properties, so loading the data is
                 # much more straightforward.
@@ -669,12 +727,128 @@ class PlyElement(object):
 
             _np.savetxt(stream, [fields], "%.18g", newline="\n")
 
+    def _fixed_list_dtype(self, byte_order, list_lens):
+        """
+        Return the on-disk dtype of a record, given the length of each
+        list property (i.e. assuming that all lists of a property have
+        the same length).  Fields are named by property position.
+
+        """
+        dtype = []
+        for k, prop in enumerate(self.properties):
+            if isinstance(prop, PlyListProperty):
+                (len_t, val_t) = prop.list_dtype(byte_order)
+                dtype.append(("l%d" % k, len_t))
+                dtype.append(("v%d" % k, val_t, (list_lens[prop.name],)))
+            else:
+                dtype.append(("v%d" % k, prop.dtype(byte_order)))
+        return dtype
+
+    def _read_bin_fixed_lists(self, stream, byte_order):
+        """
+        Fast path of _read_bin for elements whose lists have a fixed
+        length (e.g. triangle faces).  The list lengths are taken from
+        the first record and the whole element is loaded with a single
+        structured np.fromfile call.  The lists are kept as (count, n)
+        arrays (see fixed_list), the object columns of data are only
+        created on access.  Return False (and restore the stream
+        position) if the lists do not have a fixed length.
+
+        """
+        if self.count == 0:
+            return False
+        try:
+            start = stream.tell()
+        except Exception:
+            return False
+
+        list_lens = {}
+        try:
+            for prop in self.properties:
+                value = prop._read_bin(stream, byte_order)
+                if isinstance(prop, PlyListProperty):
+                    list_lens[prop.name] = len(value)
+        except StopIteration:
+            stream.seek(start)
+            return False
+        stream.seek(start)
+
+        raw = _np.fromfile(
+            stream, self._fixed_list_dtype(byte_order, list_lens), self.count
+        )
+        fixed = len(raw) == self.count and all(
+            _np.all(raw["l%d" % k] == list_lens[prop.name])
+            for k, prop in enumerate(self.properties)
+            if isinstance(prop, PlyListProperty)
+        )
+        if not fixed:
+            stream.seek(start)
+            return False
+
+        self._data = _np.empty(self.count, dtype=self.dtype(byte_order))
+        self._fixed_lists = {}
+        for k, prop in enumerate(self.properties):
+            if isinstance(prop, PlyListProperty):
+                self._fixed_lists[prop.name] = raw["v%d" % k]
+            else:
+                self._data[prop.name] = raw["v%d" % k]
+        self._pending_lists = list(self._fixed_lists)
+        return True
+
+    def _write_bin_fixed_lists(self, stream, byte_order):
+        """
+        Fast path of _write_bin for elements whose lists have a fixed
+        length.  The whole element is encoded into a single structured
+        array.  Return False (without writing anything) if the lists do
+        not have a fixed length.
+
+        """
+        if self.count == 0:
+            return False
+
+        list_values = {}
+        for prop in self.properties:
+            if isinstance(prop, PlyListProperty):
+                (len_t, val_t) = prop.list_dtype(byte_order)
+                if prop.name in self._pending_lists:
+                    # the (unmodified) values read by _read_bin_fixed_lists
+                    column = self._fixed_lists[prop.name]
+                else:
+                    column = self.data[prop.name]
+                if column.dtype == object:
+                    column = column.tolist()
+                try:
+                    values = _np.asarray(column, dtype=val_t)
+                except ValueError:
+                    return False
+                if values.ndim != 2 or values.shape[0] != self.count:
+                    return False
+                list_values[prop.name] = values
+
+        list_lens = dict(
+            (name, values.shape[1]) for (name, values) in list_values.items()
+        )
+        raw = _np.empty(
+            self.count, dtype=self._fixed_list_dtype(byte_order, list_lens)
+        )
+        for k, prop in enumerate(self.properties):
+            if isinstance(prop, PlyListProperty):
+                raw["l%d" % k] = list_lens[prop.name]
+                raw["v%d" % k] = list_values[prop.name]
+            else:
+                raw["v%d" % k] = self._data[prop.name]
+        raw.tofile(stream)
+        return True
+
     def _read_bin(self, stream, byte_order):
         """
         Load a PLY element from a binary PLY file.  The element may
         contain list properties.
 
         """
+        if self._read_bin_fixed_lists(stream, byte_order):
+            return
+
         self._data = _np.empty(self.count, dtype=self.dtype(byte_order))
 
         for k in _range(self.count):
@@ -692,6 +866,9 @@ class PlyElement(object):
         contain list properties.
 
         """
+        if self._write_bin_fixed_lists(stream, byte_order):
+            return
+
         for rec in self.data:
             for prop in self.properties:
                 prop._write_bin(rec[prop.name], stream, byte_order)
@@ -1,32 +1,50 @@
 import os
-from shutil import copyfile
+from shutil import copyfile, rmtree
 from enum import Enum
 from ssr.utility.os_extension import mkdir_safely
 from ssr.utility.logging_extension import logger
 from ssr.meshlab_utility.meshlab import Meshlab
 
-# Important: The "main_mesh" import MUST BE CALLED BEFORE "Pyntcloud", in order
-# to properly execute "matplotlib.use('Agg')" in "main_mesh"
 from ssr_eval.config.eval_config import EvalConfig
 from ssr_eval.ssr_toolset.evaluate_ssr_surface import evaluate_mesh
+from ssr_eval.ssr_toolset.align_worker_pool import (
+    AlignWorkerPool,
+    uses_align_worker_pool,
+)
+from ssr_eval.ssr_toolset.ground_truth_cache import GroundTruthCache
+from ssr_eval.ssr_toolset.utm_point_cache import UtmPointCache
+from ssr_eval.ssr_toolset.mesh_sample_cache import MeshSampleCache
+from ssr_eval.ssr_toolset.job_scheduler import split_cpu_budget, run_jobs
+from ssr_eval.ext.vissat_toolset_lib.ply_np_converter import (
+    get_ply_num_vertices,
+)
 from ssr_eval.utility.check_consistent_output_name import (
     verify_correct_output_name,
 )
-from pyntcloud import PyntCloud
-
+from ssr_eval.utility.evaluation_manifest import (
+    get_evaluation_fingerprint,
+    is_up_to_date,
+    read_manifest,
+    write_manifest,
+)
 
 SamplingMethods = Enum(
-    "SamplingMethods", "vertex stratified_triangle montecarlo poisson_disk"
+    "SamplingMethods",
+    "vertex stratified_triangle montecarlo poisson_disk triangle_raster",
 )
 
 
 class Result:
-    def __init__(self, name, median_err, completeness):
+    def __init__(self, name, median_err, completeness, error=None):
         self.name = name
         self.median_err = median_err
         self.completeness = completeness
+        # traceback, if the evaluation failed
+        self.error = error
 
     def __str__(self):
+        if self.error is not None:
+            return f"name: {self.name} \n failed"
         return (
             f"name: {self.name} \n median_err: {self.median_err:.3f} \n"
             + f"completeness: {100 * self.completeness:.1f}"
@@ -62,11 +80,192 @@ def get_mesh_files(meshes_idp, algo_target_dn_list, mesh_target_fn):
     return mesh_ifp_list
 
 
-def get_num_vertices_of_ply(ifp):
-    point_cloud = PyntCloud.from_file(ifp)
-    points = point_cloud.points.loc[:, ["x", "y", "z"]].to_numpy()
-    num_vertices = points.shape[0]
-    return num_vertices
+# Objects shared by the meshes evaluated in this process (see
+# _init_mesh_worker)
+_mesh_worker_state = {}
+
+
+def _init_mesh_worker(
+    ssr_eval_config, num_align_processes, separate_meshlab_temp_dp
+):
+    meshlab_temp_dp = ssr_eval_config.meshlab_temp_dp
+    if separate_meshlab_temp_dp:
+        # Concurrently running Meshlab instances use separate directories
+        meshlab_temp_dp = os.path.join(
+            meshlab_temp_dp, f"worker_{os.getpid()}"
+        )
+        os.makedirs(meshlab_temp_dp, exist_ok=True)
+    _mesh_worker_state["meshlab"] = Meshlab(
+        executable_fp=ssr_eval_config.meshlab_server_fp,
+        meshlab_temp_dp=meshlab_temp_dp,
+    )
+    # Reuse the same worker processes for all meshes. The pool is only
+    # created if it is used, i.e. by the shared memory alignment backend or
+    # by the tiled dsm production (the manager backend starts new processes
+    # for each alignment).
+    _mesh_worker_state["num_align_processes"] = num_align_processes
+    if (
+        uses_align_worker_pool(ssr_eval_config.alignment_worker_backend)
+        or ssr_eval_config.dsm_tile_size is not None
+    ):
+        align_worker_pool = AlignWorkerPool(num_align_processes)
+    else:
+        align_worker_pool = None
+    _mesh_worker_state["align_worker_pool"] = align_worker_pool
+    # Load the ground truth of the site only once
+    _mesh_worker_state["ground_truth_cache"] = GroundTruthCache(
+        ssr_eval_config.ground_truth_cache_dp
+    )
+    if ssr_eval_config.utm_point_cache_dp is not None:
+        utm_point_cache = UtmPointCache(
+            ssr_eval_config.utm_point_cache_dp,
+            max_size=int(ssr_eval_config.utm_point_cache_max_size_gb * 2**30),
+        )
+    else:
+        utm_point_cache = None
+    _mesh_worker_state["utm_point_cache"] = utm_point_cache
+    if ssr_eval_config.sample_cache_dp is not None:
+        sample_cache = MeshSampleCache(
+            ssr_eval_config.sample_cache_dp,
+            max_size=int(ssr_eval_config.sample_cache_max_size_gb * 2**30),
+        )
+    else:
+        sample_cache = None
+    _mesh_worker_state["sample_cache"] = sample_cache
+
+
+def evaluate_mesh_file(mesh_ifp, ssr_eval_config, vissat_fused_num_vertices):
+    # Samples (if required) and evaluates a single mesh using the objects
+    # created by _init_mesh_worker
+    fill_small_holes = ssr_eval_config.fill_small_holes
+    sampling_method = SamplingMethods[ssr_eval_config.sampling_method]
+    # triangle_raster rasterizes the faces of the mesh directly (i.e. the
+    # mesh is not sampled with Meshlab)
+    rasterize_faces = sampling_method == SamplingMethods.triangle_raster
+    sample_vertices = (
+        sampling_method != SamplingMethods.vertex and not rasterize_faces
+    )
+    vissat_dataset_site_idp = ssr_eval_config.vissat_dataset_site_idp
+    odp = ssr_eval_config.odp
+
+    if ssr_eval_config.check_output_name_correctness:
+        verify_correct_output_name(vissat_dataset_site_idp, mesh_ifp, odp)
+    sampling_method_str = sampling_method.name
+    odn = os.path.basename(os.path.dirname(mesh_ifp))
+    specific_suffix = f"_sm_{sampling_method_str}"
+    if fill_small_holes:
+        specific_suffix += "_hf"
+    specific_odp = os.path.join(odp, odn + specific_suffix)
+
+    # Identifies the inputs and parameters of the results
+    fingerprint = get_evaluation_fingerprint(
+        mesh_ifp,
+        os.path.join(vissat_dataset_site_idp, "ground_truth.tif"),
+        sampling_method_str,
+        fill_small_holes,
+        settings={
+            "num_samples": (
+                vissat_fused_num_vertices if sample_vertices else None
+            ),
+            "sampling_seed": ssr_eval_config.sampling_seed,
+            "alignment_search_mode": ssr_eval_config.alignment_search_mode,
+            "alignment_search_radius": (
+                ssr_eval_config.alignment_search_radius
+            ),
+            "alignment_pad_width": ssr_eval_config.alignment_pad_width,
+            "alignment_adaptive_search": (
+                ssr_eval_config.alignment_adaptive_search
+            ),
+            "alignment_subpixel_refinement": (
+                ssr_eval_config.alignment_subpixel_refinement
+            ),
+        },
+    )
+    if ssr_eval_config.incremental:
+        if is_up_to_date(specific_odp, fingerprint):
+            logger.info(f"Skipping {mesh_ifp}, {specific_odp} is up to date")
+            metrics = read_manifest(specific_odp)["metrics"]
+            return Result(name=odn, **metrics)
+        if os.path.isdir(specific_odp):
+            # results of changed inputs or of an incomplete evaluation
+            logger.info(f"Removing stale results in {specific_odp}")
+            rmtree(specific_odp)
+    else:
+        assert_msg = f"Directory already exists: {specific_odp}"
+        assert not os.path.isdir(specific_odp), assert_msg
+    os.mkdir(specific_odp)
+
+    if sample_vertices:
+        stem, ext = os.path.splitext(os.path.basename(mesh_ifp))
+        sampled_point_cloud_fp = os.path.join(
+            specific_odp, f"{stem}{specific_suffix}{ext}"
+        )
+        logger.vinfo("sampled_point_cloud_fp", sampled_point_cloud_fp)
+
+        # Use for each mesh the same number of samples
+        # (i.e. the number of points in fused.ply)
+        if _mesh_worker_state["sample_cache"] is not None:
+            _mesh_worker_state["sample_cache"].sample_mesh(
+                _mesh_worker_state["meshlab"],
+                mesh_ifp,
+                sampled_point_cloud_fp,
+                vissat_fused_num_vertices,
+                sampling_method.name,
+                seed=ssr_eval_config.sampling_seed,
+            )
+        else:
+            _mesh_worker_state["meshlab"].sample_mesh(
+                mesh_ifp,
+                sampled_point_cloud_fp,
+                vissat_fused_num_vertices,
+                sampling_method.name,
+            )
+    else:
+        sampled_point_cloud_fp = mesh_ifp
+
+    median_err, completeness = evaluate_mesh(
+        site_data_dir=vissat_dataset_site_idp,
+        in_ply=sampled_point_cloud_fp,
+        out_dir=specific_odp,
+        fill_small_holes=fill_small_holes,
+        max_processes=_mesh_worker_state["num_align_processes"],
+        write_mesh=False,
+        search_mode=ssr_eval_config.alignment_search_mode,
+        worker_backend=ssr_eval_config.alignment_worker_backend,
+        worker_pool=_mesh_worker_state["align_worker_pool"],
+        search_radius=ssr_eval_config.alignment_search_radius,
+        target_pad_width=ssr_eval_config.alignment_pad_width,
+        adaptive_search=ssr_eval_config.alignment_adaptive_search,
+        subpixel_refinement=ssr_eval_config.alignment_subpixel_refinement,
+        stream_chunk_size=ssr_eval_config.stream_chunk_size,
+        dsm_tile_size=ssr_eval_config.dsm_tile_size,
+        dsm_tif_options=ssr_eval_config.dsm_tif_options.dict(),
+        rasterize_faces=rasterize_faces,
+        ground_truth_cache=_mesh_worker_state["ground_truth_cache"],
+        utm_point_cache=_mesh_worker_state["utm_point_cache"],
+    )
+
+    logger.info("---------------------------------------------")
+    logger.vinfo("mesh_ifp", mesh_ifp)
+    logger.vinfo("fill_small_holes", fill_small_holes)
+    logger.vinfo("odp", specific_odp)
+    logger.vinfo("sampled_point_cloud_fp", sampled_point_cloud_fp)
+    logger.vinfo("median_err", f"{median_err:.3f}")
+    logger.vinfo("completeness", f"{100 * completeness:.1f}")
+    logger.info("---------------------------------------------")
+    write_manifest(
+        specific_odp,
+        fingerprint,
+        {
+            "median_err": float(median_err),
+            "completeness": float(completeness),
+        },
+    )
+    return Result(
+        name=odn,
+        median_err=median_err,
+        completeness=completeness,
+    )
 
 
 if __name__ == "__main__":
@@ -81,7 +280,6 @@ if __name__ == "__main__":
         assert False, abort_msg
     ssr_eval_config = EvalConfig.get_from_file(ssr_eval_config_fp)
 
-    fill_small_holes = ssr_eval_config.fill_small_holes
     sampling_method = SamplingMethods[ssr_eval_config.sampling_method]
     # assert sampling_method in list(map(str, SamplingMethods))
 
@@ -91,79 +289,61 @@ if __name__ == "__main__":
         mesh_target_fn=ssr_eval_config.mesh_target_fn,
     )
 
-    sample_vertices = sampling_method != SamplingMethods.vertex
+    # triangle_raster rasterizes the faces of the mesh directly (i.e. the
+    # mesh is not sampled with Meshlab)
+    rasterize_faces = sampling_method == SamplingMethods.triangle_raster
+    sample_vertices = (
+        sampling_method != SamplingMethods.vertex and not rasterize_faces
+    )
     if sample_vertices:
         vissat_fused_ifp = ssr_eval_config.vissat_fused_ifp
         logger.vinfo("vissat_fused_ifp", vissat_fused_ifp)
-        vissat_fused_num_vertices = get_num_vertices_of_ply(vissat_fused_ifp)
+        # only the header of fused.ply is parsed
+        vissat_fused_num_vertices = get_ply_num_vertices(vissat_fused_ifp)
         logger.vinfo("vissat_fused_num_vertices", vissat_fused_num_vertices)
     else:
         vissat_fused_num_vertices = None
 
-    res_tripplets = []
-    vissat_dataset_site_idp = ssr_eval_config.vissat_dataset_site_idp
-    odp = ssr_eval_config.odp
-    mkdir_safely(odp)
-    meshlab = Meshlab(
-        executable_fp=ssr_eval_config.meshlab_server_fp,
-        meshlab_temp_dp=ssr_eval_config.meshlab_temp_dp,
-    )
-    for mesh_ifp in mesh_ifp_list:
-
-        if ssr_eval_config.check_output_name_correctness:
-            verify_correct_output_name(vissat_dataset_site_idp, mesh_ifp, odp)
-        sampling_method_str = sampling_method.name
-        odn = os.path.basename(os.path.dirname(mesh_ifp))
-        specific_suffix = f"_sm_{sampling_method_str}"
-        if fill_small_holes:
-            specific_suffix += "_hf"
-        specific_odp = os.path.join(odp, odn + specific_suffix)
-        assert_msg = f"Directory already exists: {specific_odp}"
-        assert not os.path.isdir(specific_odp), assert_msg
-        os.mkdir(specific_odp)
+    mkdir_safely(ssr_eval_config.odp)
 
-        if sample_vertices:
-            stem, ext = os.path.splitext(os.path.basename(mesh_ifp))
-            sampled_point_cloud_fp = os.path.join(
-                specific_odp, f"{stem}{specific_suffix}{ext}"
-            )
-            logger.vinfo("sampled_point_cloud_fp", sampled_point_cloud_fp)
-
-            # Use for each mesh the same number of samples
-            # (i.e. the number of points in fused.ply)
-            meshlab.sample_mesh(
-                mesh_ifp,
-                sampled_point_cloud_fp,
-                vissat_fused_num_vertices,
-                sampling_method.name,
-            )
-        else:
-            sampled_point_cloud_fp = mesh_ifp
-
-        median_err, completeness = evaluate_mesh(
-            site_data_dir=vissat_dataset_site_idp,
-            in_ply=sampled_point_cloud_fp,
-            out_dir=specific_odp,
-            fill_small_holes=fill_small_holes,
-            max_processes=16,
-            write_mesh=False,
-        )
+    # Split the cores between concurrently evaluated meshes and the
+    # alignment worker processes of each mesh
+    num_parallel_meshes, num_align_processes = split_cpu_budget(
+        ssr_eval_config.max_processes,
+        len(mesh_ifp_list),
+        ssr_eval_config.max_parallel_meshes,
+    )
+    logger.vinfo("num_parallel_meshes", num_parallel_meshes)
+    logger.vinfo("num_align_processes", num_align_processes)
+    job_results = run_jobs(
+        evaluate_mesh_file,
+        [
+            (mesh_ifp, ssr_eval_config, vissat_fused_num_vertices)
+            for mesh_ifp in mesh_ifp_list
+        ],
+        num_parallel_meshes,
+        initializer=_init_mesh_worker,
+        initargs=(
+            ssr_eval_config,
+            num_align_processes,
+            num_parallel_meshes > 1,
+        ),
+    )
+    if _mesh_worker_state.get("align_worker_pool") is not None:
+        _mesh_worker_state["align_worker_pool"].close()
 
-        logger.info("---------------------------------------------")
-        logger.vinfo("mesh_ifp", mesh_ifp)
-        logger.vinfo("fill_small_holes", fill_small_holes)
-        logger.vinfo("odp", specific_odp)
-        logger.vinfo("sampled_point_cloud_fp", sampled_point_cloud_fp)
-        logger.vinfo("median_err", f"{median_err:.3f}")
-        logger.vinfo("completeness", f"{100 * completeness:.1f}")
-        logger.info("---------------------------------------------")
-        res_tripplets.append(
-            Result(
+    # A failed mesh does not abort the evaluation of the other meshes
+    res_tripplets = []
+    for mesh_ifp, (res, error) in zip(mesh_ifp_list, job_results):
+        if error is not None:
+            logger.info(f"Evaluation of {mesh_ifp} failed:\n{error}")
+            res = Result(
                 name=os.path.basename(os.path.dirname(mesh_ifp)),
-                median_err=median_err,
-                completeness=completeness,
+                median_err=float("nan"),
+                completeness=float("nan"),
+                error=error,
             )
-        )
+        res_tripplets.append(res)
 
     for res in res_tripplets:
         print(res)
@@ -0,0 +1,56 @@
+import multiprocessing
+from multiprocessing import resource_tracker
+
+
+def uses_align_worker_pool(worker_backend):
+    # Only the shared memory backend exchanges the rasters with a persistent
+    # pool, the manager backend starts new processes for each alignment
+    return worker_backend == "shared_memory"
+
+
+def get_alignment_worker_pool(worker_pool, worker_backend):
+    # Returns the pool to be used by the alignment (see evaluate())
+    if uses_align_worker_pool(worker_backend):
+        return worker_pool
+    return None
+
+
+class AlignWorkerPool:
+    """
+    Long-lived pool of alignment worker processes.
+
+    The pool is created once (e.g. before looping over the meshes of a site)
+    and passed to evaluate() / align() of each mesh, which avoids starting
+    and tearing down max_processes processes (and a Manager) per mesh.
+    Rasters are exchanged with the workers via shared memory (see
+    SharedRaster), so only small task descriptions are sent to the pool.
+    """
+
+    def __init__(self, max_processes):
+        self.max_processes = max_processes
+        # The workers must share the resource tracker of this process.
+        # Otherwise each worker starts its own tracker, which considers the
+        # shared memory blocks attached by the worker as leaked.
+        resource_tracker.ensure_running()
+        self._pool = multiprocessing.Pool(processes=max_processes)
+
+    def starmap(self, func, args_list):
+        # results are returned in the order of args_list
+        return self._pool.starmap(func, args_list, chunksize=1)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
@@ -1,6 +1,8 @@
 import numpy as np
 import os
 import cv2
+import math
+import warnings
 import multiprocessing
 from ssr_eval.ext.vissat_toolset_visualization.plot_error_map import (
     plot_error_map,
@@ -11,7 +13,13 @@ from ssr_eval.ext.vissat_toolset_visualization.plot_height_map import (
 from ssr_eval.ext.vissat_toolset_visualization.plot_error_dist import (
     plot_err_dist,
 )
-from ssr_eval.ext.vissat_toolset_lib.dsm_util import read_dsm_tif
+from ssr_eval.ext.vissat_toolset_lib.dsm_util import (
+    read_dsm_tif,
+    read_dsm_tif_meta,
+    read_dsm_tif_window,
+)
+from ssr_eval.ssr_toolset.shared_raster import SharedRaster
+from ssr_eval.ssr_toolset.shift_scoring import ShiftScorer, get_valid_index
 
 
 def split_big_list(big_list, num_small_lists):
@@ -47,12 +55,15 @@ def calc_score(source, target):
 
 
 def align_worker(
-    return_dict, proc_idx, source, target, target_pad_width, xy_candi_shifts
+    return_dict,
+    proc_idx,
+    source,
+    target,
+    target_pad_width,
+    xy_candi_shifts,
+    valid_idx=None,
 ):
-    target = target[
-        target_pad_width:-target_pad_width, target_pad_width:-target_pad_width
-    ]
-    h, w = target.shape[:2]
+    scorer = ShiftScorer(source, target, target_pad_width, valid_idx=valid_idx)
 
     best_dx = None
     best_dy = None
@@ -61,15 +72,7 @@ def align_worker(
 
     for xy_shift in xy_candi_shifts:
         dx, dy = xy_shift
-
-        ul_x = target_pad_width + dx
-        ul_y = target_pad_width + dy
-        source_shifted = source[ul_y : ul_y + h, ul_x : ul_x + w]
-
-        # shift source in z direction and compute median error
-        median_dz = np.nanmedian(target - source_shifted)
-        source_shifted = source_shifted + median_dz
-        median_err = np.nanmedian(np.abs(source_shifted - target))
+        median_dz, median_err = scorer.score(dx, dy)
 
         if median_err < best_median_err:
             best_median_err = median_err
@@ -80,26 +83,234 @@ def align_worker(
     return_dict[proc_idx] = (best_dx, best_dy, best_dz, best_median_err)
 
 
-# align source_height_map to target_height_map
-# source, target are of the same size
-def align(
+def align_worker_shared(
+    result_spec,
+    source_spec,
+    target_spec,
+    target_pad_width,
+    xy_candi_shifts,
+    first_candi_idx,
+    cell_stride=1,
+    valid_idx_spec=None,
+):
+    # Attach to the rasters created by the parent process (no copy) and
+    # write (median_dz, median_err) of each candidate into the result rows
+    # first_candi_idx, ..., first_candi_idx + len(xy_candi_shifts) - 1
+    source_raster = SharedRaster.attach(source_spec)
+    target_raster = SharedRaster.attach(target_spec)
+    result_raster = SharedRaster.attach(result_spec, read_only=False)
+    valid_idx_raster = None
+    if valid_idx_spec is not None:
+        valid_idx_raster = SharedRaster.attach(valid_idx_spec)
+    scorer = None
+    try:
+        scorer = ShiftScorer(
+            source_raster.array,
+            target_raster.array,
+            target_pad_width,
+            cell_stride=cell_stride,
+            valid_idx=(
+                None if valid_idx_raster is None else valid_idx_raster.array
+            ),
+        )
+        for offset, (dx, dy) in enumerate(xy_candi_shifts):
+            result_raster.array[first_candi_idx + offset] = scorer.score(
+                dx, dy
+            )
+    finally:
+        # the scorer holds views of the shared buffers, which must be
+        # released before closing them (also if the scoring raised)
+        scorer = None
+        source_raster.close()
+        target_raster.close()
+        result_raster.close()
+        if valid_idx_raster is not None:
+            valid_idx_raster.close()
+
+
+def align_worker_pruned(
+    result_spec,
+    source_spec,
+    target_spec,
+    target_pad_width,
+    xy_candi_shifts,
+    candi_indices,
+    valid_idx_spec=None,
+):
+    # Compute the exact scores of the candidates and write them into the
+    # result rows candi_indices (i.e. the candidates are not contiguous)
+    source_raster = SharedRaster.attach(source_spec)
+    target_raster = SharedRaster.attach(target_spec)
+    result_raster = SharedRaster.attach(result_spec, read_only=False)
+    valid_idx_raster = None
+    if valid_idx_spec is not None:
+        valid_idx_raster = SharedRaster.attach(valid_idx_spec)
+    scorer = None
+    try:
+        scorer = ShiftScorer(
+            source_raster.array,
+            target_raster.array,
+            target_pad_width,
+            valid_idx=(
+                None if valid_idx_raster is None else valid_idx_raster.array
+            ),
+        )
+        for candi_idx, (dx, dy) in zip(candi_indices, xy_candi_shifts):
+            result_raster.array[candi_idx] = scorer.score(dx, dy)
+    finally:
+        # the scorer holds views of the shared buffers, which must be
+        # released before closing them (also if the scoring raised)
+        scorer = None
+        source_raster.close()
+        target_raster.close()
+        result_raster.close()
+        if valid_idx_raster is not None:
+            valid_idx_raster.close()
+
+
+def downsample_height_map(height_map):
+    # average 2x2 blocks, nan cells are ignored (blocks without any valid
+    # cell become nan). A trailing odd row / column is dropped.
+    h, w = height_map.shape[:2]
+    h_half, w_half = h // 2, w // 2
+    blocks = height_map[: 2 * h_half, : 2 * w_half].reshape(
+        (h_half, 2, w_half, 2)
+    )
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return np.nanmean(blocks, axis=(1, 3))
+
+
+def _select_best_shifts(scored_shifts, num_shifts):
+    # scored_shifts: list of (median_err, dx, dy, median_dz)
+    # Sorting by (median_err, dx, dy) reproduces the tie breaking of the
+    # exhaustive search, which iterates dx (outer) and dy (inner) in
+    # ascending order. Shifts without valid cells (nan error) come last.
+    scored_shifts = sorted(
+        scored_shifts,
+        key=lambda s: (np.isnan(s[0]), s[0], s[1], s[2]),
+    )
+    return scored_shifts[:num_shifts]
+
+
+def pyramid_search(
     source,
     target,
-    out_dir,
     target_pad_width,
     search_radius,
-    cell_physical_size,
-    max_processes,
+    max_processes=1,
+    worker_pool=None,
+    num_levels=3,
+    num_candidates=3,
+    refine_radius=2,
+    valid_idx=None,
 ):
-    # plot_height_map(source, os.path.join(out_dir, 'source_before_align.jpg'), save_cbar=True)
-    # plot_height_map(target, os.path.join(out_dir, 'target_before_align.jpg'), save_cbar=True)
+    """
+    Coarse-to-fine search of the best (dx, dy, dz) shift.
+
+    source and target are the padded height maps (see align()). Both are
+    downsampled num_levels times by a factor of 2. The full (scaled)
+    search window is only evaluated on the coarsest level, the best
+    num_candidates shifts are then refined on each finer level within
+    +/- refine_radius cells around the up-scaled shift. valid_idx (see
+    get_valid_index()) is only used on the finest level.
+
+    The candidates of each level are scored in parallel by max_processes
+    worker processes (or by the worker_pool) attached to shared memory
+    copies of the level's height maps.
+    """
+    if worker_pool is not None:
+        max_processes = worker_pool.max_processes
+
+    # each level requires a padded margin of at least one cell
+    while num_levels > 0 and target_pad_width >> num_levels == 0:
+        num_levels -= 1
 
-    # all candidate shifts
+    source_pyramid = [source]
+    target_pyramid = [target]
+    for _ in range(num_levels):
+        source_pyramid.append(downsample_height_map(source_pyramid[-1]))
+        target_pyramid.append(downsample_height_map(target_pyramid[-1]))
+
+    def _score_level(level, xy_candi_shifts):
+        scores = score_shifts_shared_memory(
+            source_pyramid[level],
+            target_pyramid[level],
+            target_pad_width >> level,
+            xy_candi_shifts,
+            max_processes,
+            worker_pool=worker_pool,
+            valid_idx=valid_idx if level == 0 else None,
+        )
+        return [
+            (median_err, dx, dy, median_dz)
+            for (dx, dy), (median_dz, median_err) in zip(
+                xy_candi_shifts, scores
+            )
+        ]
+
+    def _get_level_radius(level):
+        # the shifts must not leave the padded area of the level
+        if level == 0:
+            return search_radius
+        level_radius = int(math.ceil(search_radius / 2**level))
+        return min(level_radius, target_pad_width >> level)
+
+    # exhaustive search on the coarsest level
+    coarse_radius = _get_level_radius(num_levels)
+    xy_candi_shifts = [
+        (dx, dy)
+        for dx in range(-coarse_radius, coarse_radius + 1)
+        for dy in range(-coarse_radius, coarse_radius + 1)
+    ]
+    candidates = _select_best_shifts(
+        _score_level(num_levels, xy_candi_shifts), num_candidates
+    )
+
+    # refine the best candidates on the finer levels
+    for level in range(num_levels - 1, -1, -1):
+        level_radius = _get_level_radius(level)
+        xy_candi_shifts = set()
+        for _, coarse_dx, coarse_dy, _ in candidates:
+            for ddx in range(-refine_radius, refine_radius + 1):
+                for ddy in range(-refine_radius, refine_radius + 1):
+                    dx = 2 * coarse_dx + ddx
+                    dy = 2 * coarse_dy + ddy
+                    dx = max(-level_radius, min(dx, level_radius))
+                    dy = max(-level_radius, min(dy, level_radius))
+                    xy_candi_shifts.add((dx, dy))
+        candidates = _select_best_shifts(
+            _score_level(level, sorted(xy_candi_shifts)), num_candidates
+        )
+
+    best_median_err, best_dx, best_dy, best_dz = candidates[0]
+    return best_dx, best_dy, best_dz, best_median_err
+
+
+def _get_candidate_shifts(search_radius, scored_radius=None):
+    # all (dx, dy) shifts of the search window (dx outer, dy inner loop).
+    # Shifts within the window of scored_radius (i.e. shifts scored by a
+    # previous search) are skipped.
     xy_candi_shifts = []
     for dx in range(-search_radius, search_radius + 1, 1):
         for dy in range(-search_radius, search_radius + 1, 1):
+            if (
+                scored_radius is not None
+                and max(abs(dx), abs(dy)) <= scored_radius
+            ):
+                continue
             xy_candi_shifts.append((dx, dy))
+    return xy_candi_shifts
+
 
+def _exhaustive_search_manager(
+    source,
+    target,
+    target_pad_width,
+    xy_candi_shifts,
+    max_processes,
+    valid_idx=None,
+):
     # divide the candidate shits into subset
     xy_candi_shifts = split_big_list(xy_candi_shifts, max_processes)
     num_processes = len(
@@ -121,6 +332,7 @@ def align(
                 target,
                 target_pad_width,
                 xy_candi_shifts[i],
+                valid_idx,
             ),
         )
         jobs.append(p)
@@ -135,8 +347,549 @@ def align(
         results, key=lambda result: result[3]
     )  # sort by median_err
     best_dx, best_dy, best_dz, best_median_err = results[0]
+    return best_dx, best_dy, best_dz, best_median_err
+
+
+def run_shared_memory_tasks(worker_func, args_list, worker_pool=None):
+    # Run worker_func(*args) for each entry of args_list. The workers
+    # communicate via shared memory, i.e. their return values are ignored.
+    if worker_pool is not None:
+        worker_pool.starmap(worker_func, args_list)
+        return
+
+    jobs = []
+    for args in args_list:
+        p = multiprocessing.Process(target=worker_func, args=args)
+        jobs.append(p)
+        p.start()
+
+    for proc in jobs:
+        proc.join()
+    for proc in jobs:
+        assert proc.exitcode == 0, "Alignment worker failed"
+
+
+def score_shifts_shared_memory(
+    source,
+    target,
+    target_pad_width,
+    xy_candi_shifts,
+    max_processes,
+    worker_pool=None,
+    valid_idx=None,
+):
+    # Returns the (median_dz, median_err) of each candidate shift, which are
+    # computed by max_processes workers (or by the worker_pool) attached to
+    # shared memory copies of the rasters
+    num_candidates = len(xy_candi_shifts)
+    source_raster = SharedRaster.create_from_array(source)
+    target_raster = SharedRaster.create_from_array(target)
+    valid_idx_raster = None
+    valid_idx_spec = None
+    if valid_idx is not None:
+        valid_idx_raster = SharedRaster.create_from_array(valid_idx)
+        valid_idx_spec = valid_idx_raster.spec
+    # one (median_dz, median_err) row per candidate shift
+    result_raster = SharedRaster.create_empty(
+        (num_candidates, 2),
+        np.result_type(source, target),
+        fill_value=np.nan,
+    )
+    try:
+        args_list = []
+        first_candi_idx = 0
+        for candi_shifts in split_big_list(xy_candi_shifts, max_processes):
+            args_list.append(
+                (
+                    result_raster.spec,
+                    source_raster.spec,
+                    target_raster.spec,
+                    target_pad_width,
+                    candi_shifts,
+                    first_candi_idx,
+                    1,
+                    valid_idx_spec,
+                )
+            )
+            first_candi_idx += len(candi_shifts)
+        run_shared_memory_tasks(align_worker_shared, args_list, worker_pool)
+        scores = result_raster.array.copy()
+    finally:
+        source_raster.unlink()
+        target_raster.unlink()
+        result_raster.unlink()
+        if valid_idx_raster is not None:
+            valid_idx_raster.unlink()
+    return scores
+
+
+def _exhaustive_search_shared_memory(
+    source,
+    target,
+    target_pad_width,
+    xy_candi_shifts,
+    max_processes,
+    worker_pool=None,
+    valid_idx=None,
+):
+    scores = score_shifts_shared_memory(
+        source,
+        target,
+        target_pad_width,
+        xy_candi_shifts,
+        max_processes,
+        worker_pool=worker_pool,
+        valid_idx=valid_idx,
+    )
+    median_errs = scores[:, 1]
+    assert not np.all(np.isnan(median_errs))
+    # the first minimum corresponds to the shift found by a sequential
+    # search (i.e. the result does not depend on the process scheduling)
+    best_idx = int(np.nanargmin(median_errs))
+    best_dx, best_dy = xy_candi_shifts[best_idx]
+    best_dz, best_median_err = scores[best_idx]
+    return best_dx, best_dy, best_dz, best_median_err
+
+
+def exhaustive_search(
+    source,
+    target,
+    target_pad_width,
+    search_radius,
+    max_processes,
+    worker_backend="manager",
+    worker_pool=None,
+    valid_idx=None,
+    scored_radius=None,
+):
+    # all candidate shifts (except the already scored ones)
+    xy_candi_shifts = _get_candidate_shifts(search_radius, scored_radius)
+
+    if worker_pool is not None:
+        # the persistent pool always exchanges the rasters via shared memory
+        return _exhaustive_search_shared_memory(
+            source,
+            target,
+            target_pad_width,
+            xy_candi_shifts,
+            worker_pool.max_processes,
+            worker_pool=worker_pool,
+            valid_idx=valid_idx,
+        )
+    elif worker_backend == "manager":
+        return _exhaustive_search_manager(
+            source,
+            target,
+            target_pad_width,
+            xy_candi_shifts,
+            max_processes,
+            valid_idx=valid_idx,
+        )
+    elif worker_backend == "shared_memory":
+        return _exhaustive_search_shared_memory(
+            source,
+            target,
+            target_pad_width,
+            xy_candi_shifts,
+            max_processes,
+            valid_idx=valid_idx,
+        )
+    else:
+        assert False, f"Unknown worker backend: {worker_backend}"
+
+
+def pruned_search(
+    source,
+    target,
+    target_pad_width,
+    search_radius,
+    max_processes,
+    worker_pool=None,
+    cell_stride=16,
+    prune_margin=0.05,
+    valid_idx=None,
+    scored_radius=None,
+    min_num_candidates=256,
+    min_estimate_cells=10000,
+):
+    """
+    Branch-and-bound variant of the exhaustive search.
+
+    1. The median error of every shift is estimated using only every
+       cell_stride-th valid target cell.
+    2. Shifts whose estimate exceeds the smallest estimate by more than
+       prune_margin (meters) are discarded. This threshold is fixed before
+       the exact scoring starts, i.e. the result does not depend on the
+       process scheduling. The remaining shifts are distributed round-robin
+       (sorted by their estimate) to the workers, each worker scores its
+       batch with a single scorer.
+
+    prune_margin is an assumption about the accuracy of the estimates: the
+    result is identical to the result of the exhaustive search as long as
+    the estimated median error of each shift deviates less than
+    prune_margin / 2 from its exact value. For noisy height maps the margin
+    is widened according to the sampling error of the estimates. Since the
+    estimates of small rasters are unreliable (and the pruning does not pay off for few
+    shifts), the exhaustive search is used if there are less than
+    min_num_candidates shifts or if the estimates would use less than
+    min_estimate_cells cells.
+
+    Shifts within the window of scored_radius (i.e. shifts scored by a
+    previous search) are skipped.
+    """
+    xy_candi_shifts = _get_candidate_shifts(search_radius, scored_radius)
+    num_candidates = len(xy_candi_shifts)
+    if worker_pool is not None:
+        max_processes = worker_pool.max_processes
+    if valid_idx is None:
+        valid_idx = get_valid_index(
+            target[
+                target_pad_width:-target_pad_width,
+                target_pad_width:-target_pad_width,
+            ]
+        )
+
+    num_estimate_cells = len(range(0, valid_idx.size, cell_stride))
+    if (
+        num_candidates < min_num_candidates
+        or num_estimate_cells < min_estimate_cells
+    ):
+        print(
+            "pruned search: using the exhaustive search for {} candidates "
+            "and {} estimate cells".format(num_candidates, num_estimate_cells)
+        )
+        return _exhaustive_search_shared_memory(
+            source,
+            target,
+            target_pad_width,
+            xy_candi_shifts,
+            max_processes,
+            worker_pool=worker_pool,
+            valid_idx=valid_idx,
+        )
+
+    result_dtype = np.result_type(source, target)
+    source_raster = SharedRaster.create_from_array(source)
+    target_raster = SharedRaster.create_from_array(target)
+    valid_idx_raster = SharedRaster.create_from_array(valid_idx)
+    estimate_raster = SharedRaster.create_empty(
+        (num_candidates, 2), result_dtype, fill_value=np.nan
+    )
+    result_raster = SharedRaster.create_empty(
+        (num_candidates, 2), result_dtype, fill_value=np.nan
+    )
+    try:
+        # estimate the scores of all candidates
+        args_list = []
+        first_candi_idx = 0
+        for candi_shifts in split_big_list(xy_candi_shifts, max_processes):
+            args_list.append(
+                (
+                    estimate_raster.spec,
+                    source_raster.spec,
+                    target_raster.spec,
+                    target_pad_width,
+                    candi_shifts,
+                    first_candi_idx,
+                    cell_stride,
+                    valid_idx_raster.spec,
+                )
+            )
+            first_candi_idx += len(candi_shifts)
+        run_shared_memory_tasks(align_worker_shared, args_list, worker_pool)
+
+        estimated_errs = estimate_raster.array[:, 1]
+        assert not np.all(np.isnan(estimated_errs))
+        min_estimated_err = np.nanmin(estimated_errs)
+        # The margin must also cover the sampling error of the estimates.
+        # The standard error of a median absolute error estimated from n
+        # cells is about 1.2 * median / sqrt(n) (for normally distributed
+        # errors), i.e. the margin is widened to about 8 standard errors
+        # for noisy height maps.
+        margin = max(
+            prune_margin, 10 * min_estimated_err / np.sqrt(num_estimate_cells)
+        )
+        promising_indices = np.flatnonzero(
+            estimated_errs <= min_estimated_err + margin
+        )
+        promising_indices = promising_indices[
+            np.argsort(estimated_errs[promising_indices], kind="stable")
+        ]
+
+        # compute the exact scores of the promising candidates, the
+        # round-robin split balances the batches of the workers
+        args_list = []
+        for proc_idx in range(min(max_processes, len(promising_indices))):
+            candi_indices = promising_indices[proc_idx::max_processes]
+            args_list.append(
+                (
+                    result_raster.spec,
+                    source_raster.spec,
+                    target_raster.spec,
+                    target_pad_width,
+                    [xy_candi_shifts[idx] for idx in candi_indices],
+                    candi_indices,
+                    valid_idx_raster.spec,
+                )
+            )
+        run_shared_memory_tasks(align_worker_pruned, args_list, worker_pool)
+
+        median_errs = result_raster.array[:, 1]
+        print(
+            "pruned search: exact scores for {} of {} candidates".format(
+                len(promising_indices), num_candidates
+            )
+        )
+        # the first minimum corresponds to the shift found by the
+        # exhaustive search (if it has not been pruned)
+        best_idx = int(np.nanargmin(median_errs))
+        best_dx, best_dy = xy_candi_shifts[best_idx]
+        best_dz, best_median_err = result_raster.array[best_idx]
+    finally:
+        source_raster.unlink()
+        target_raster.unlink()
+        valid_idx_raster.unlink()
+        estimate_raster.unlink()
+        result_raster.unlink()
+    return best_dx, best_dy, best_dz, best_median_err
+
+
+def search_best_shift(
+    source,
+    target,
+    target_pad_width,
+    search_radius,
+    max_processes,
+    search_mode="exhaustive",
+    worker_backend="manager",
+    worker_pool=None,
+    valid_idx=None,
+    scored_radius=None,
+):
+    # valid_idx: optional flat indices of the valid cells of the unpadded
+    #   target (see get_valid_index()), which are otherwise recomputed by
+    #   each scorer
+    # scored_radius: the shifts within the window of scored_radius have
+    #   been scored by a previous search and are skipped by the exhaustive
+    #   and the pruned search (the pyramid search does not score the whole
+    #   window and always searches the full window)
+    if search_mode == "exhaustive":
+        best_dx, best_dy, best_dz, best_median_err = exhaustive_search(
+            source,
+            target,
+            target_pad_width,
+            search_radius,
+            max_processes,
+            worker_backend=worker_backend,
+            worker_pool=worker_pool,
+            valid_idx=valid_idx,
+            scored_radius=scored_radius,
+        )
+    elif search_mode == "pyramid":
+        best_dx, best_dy, best_dz, best_median_err = pyramid_search(
+            source,
+            target,
+            target_pad_width,
+            search_radius,
+            max_processes,
+            worker_pool=worker_pool,
+            valid_idx=valid_idx,
+        )
+    elif search_mode == "pruned":
+        best_dx, best_dy, best_dz, best_median_err = pruned_search(
+            source,
+            target,
+            target_pad_width,
+            search_radius,
+            max_processes,
+            worker_pool=worker_pool,
+            valid_idx=valid_idx,
+            scored_radius=scored_radius,
+        )
+    else:
+        assert False, f"Unknown search mode: {search_mode}"
+    return best_dx, best_dy, best_dz, best_median_err
+
+
+def _get_parabola_vertex(err_minus, err_center, err_plus):
+    # position of the vertex of the parabola through (-1, err_minus),
+    # (0, err_center) and (1, err_plus), restricted to [-0.5, 0.5]
+    curvature = err_minus - 2 * err_center + err_plus
+    if not np.isfinite(curvature) or curvature <= 0:
+        return 0.0
+    vertex = 0.5 * (err_minus - err_plus) / curvature
+    return float(np.clip(vertex, -0.5, 0.5))
+
+
+def shift_height_map(source, target_pad_width, dx, dy, shape):
+    # Returns the window of source that corresponds to the (possibly
+    # fractional) shift dx, dy. Values are bilinearly interpolated from the
+    # valid neighbors (normalized interpolation), cells are valid iff the
+    # nearest source cell is valid (i.e. the coverage equals the coverage
+    # of the rounded integer shift).
+    h, w = shape[:2]
+    affine_mat = np.array(
+        [
+            [1.0, 0.0, -(target_pad_width + dx)],
+            [0.0, 1.0, -(target_pad_width + dy)],
+        ]
+    )
+
+    def _warp(image, flags, border_value):
+        return cv2.warpAffine(
+            image,
+            affine_mat,
+            (w, h),
+            flags=flags,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=border_value,
+        )
+
+    valid = np.logical_not(np.isnan(source))
+    weights = _warp(valid.astype(source.dtype), cv2.INTER_LINEAR, 0.0)
+    weighted_sum = _warp(
+        np.where(valid, source, 0.0).astype(source.dtype),
+        cv2.INTER_LINEAR,
+        0.0,
+    )
+    source_shifted = _warp(source, cv2.INTER_NEAREST, np.nan)
+    mask = np.logical_not(np.isnan(source_shifted))
+    source_shifted[mask] = weighted_sum[mask] / weights[mask]
+    return source_shifted
+
+
+def refine_shift_subpixel(
+    source, target, target_pad_width, best_dx, best_dy, valid_idx=None
+):
+    """
+    Refine the integer shift (best_dx, best_dy) to subpixel precision.
+
+    A parabola is fitted (separately in x and y direction) to the median
+    errors of the integer shifts around the best shift. The source is then
+    interpolated at the resulting fractional shift to recompute the median
+    dz. Returns None if the refinement is not possible, otherwise
+    (refined_dx, refined_dy, refined_dz).
+    """
+    if max(abs(best_dx), abs(best_dy)) + 1 > target_pad_width:
+        return None
+
+    scorer = ShiftScorer(source, target, target_pad_width, valid_idx=valid_idx)
+    _, err_center = scorer.score(best_dx, best_dy)
+    _, err_left = scorer.score(best_dx - 1, best_dy)
+    _, err_right = scorer.score(best_dx + 1, best_dy)
+    _, err_up = scorer.score(best_dx, best_dy - 1)
+    _, err_down = scorer.score(best_dx, best_dy + 1)
+    del scorer
+
+    refined_dx = best_dx + _get_parabola_vertex(
+        err_left, err_center, err_right
+    )
+    refined_dy = best_dy + _get_parabola_vertex(err_up, err_center, err_down)
+    if refined_dx == best_dx and refined_dy == best_dy:
+        return None
+
+    target = target[
+        target_pad_width:-target_pad_width, target_pad_width:-target_pad_width
+    ]
+    source_shifted = shift_height_map(
+        source, target_pad_width, refined_dx, refined_dy, target.shape
+    )
+    refined_dz = np.nanmedian(target - source_shifted)
+    return refined_dx, refined_dy, refined_dz
+
+
+# align source_height_map to target_height_map
+# source, target are of the same size
+def align(
+    source,
+    target,
+    out_dir,
+    target_pad_width,
+    search_radius,
+    cell_physical_size,
+    max_processes,
+    search_mode="exhaustive",
+    worker_backend="manager",
+    worker_pool=None,
+    adaptive_search=False,
+    initial_search_radius=4,
+    subpixel_refinement=False,
+    target_valid_idx=None,
+):
+    # search_mode:
+    #   - exhaustive: evaluate every shift in the search window (default)
+    #   - pyramid: coarse-to-fine search on downsampled height maps
+    #   - pruned: exhaustive search, which computes exact scores only for
+    #       shifts with a promising (subsampled) estimate
+    # worker_backend (only relevant for the exhaustive search, the pyramid
+    #   and the pruned search always use shared memory workers):
+    #   - manager: pass copies of the rasters to the worker processes and
+    #       collect the results with a multiprocessing.Manager (default)
+    #   - shared_memory: workers attach to a single shared copy of the
+    #       rasters and write their results into a shared result array
+    # worker_pool: optional AlignWorkerPool, which is reused across calls.
+    #   If provided, it replaces the worker_backend and max_processes.
+    # adaptive_search: start with initial_search_radius and double the
+    #   radius (up to search_radius) while the best shift lies on the border
+    #   of the search window. search_radius must not exceed target_pad_width.
+    # subpixel_refinement: refine the best integer shift to a fractional
+    #   shift. The refined shift and its scores are only written to
+    #   offset.txt, the returned metrics (and the plots) always use the
+    #   integer shift. The interpolation of the source smooths it, i.e. the
+    #   refined scores are biased and not comparable with unrefined results.
+    # target_valid_idx: flat indices of the valid cells of the unpadded
+    #   target (see get_valid_index()), computed if not provided
+    # plot_height_map(source, os.path.join(out_dir, 'source_before_align.jpg'), save_cbar=True)
+    # plot_height_map(target, os.path.join(out_dir, 'target_before_align.jpg'), save_cbar=True)
+
+    if target_valid_idx is None:
+        target_valid_idx = get_valid_index(
+            target[
+                target_pad_width:-target_pad_width,
+                target_pad_width:-target_pad_width,
+            ]
+        )
+
+    if adaptive_search:
+        current_search_radius = min(initial_search_radius, search_radius)
+    else:
+        current_search_radius = search_radius
+    best_shift = None
+    scored_radius = None
+    while True:
+        dx, dy, dz, median_err = search_best_shift(
+            source,
+            target,
+            target_pad_width,
+            current_search_radius,
+            max_processes,
+            search_mode=search_mode,
+            worker_backend=worker_backend,
+            worker_pool=worker_pool,
+            valid_idx=target_valid_idx,
+            scored_radius=scored_radius,
+        )
+        # the widened window only scores the new shifts, i.e. the best shift
+        # of the previous windows is kept (ties are resolved like in the
+        # exhaustive search)
+        scored_shifts = [(median_err, dx, dy, dz)]
+        if best_shift is not None:
+            scored_shifts.append(best_shift)
+        best_shift = _select_best_shifts(scored_shifts, 1)[0]
+        best_median_err, best_dx, best_dy, best_dz = best_shift
+        # widen the search window, if the best shift lies on its border
+        on_border = max(abs(best_dx), abs(best_dy)) == current_search_radius
+        if not on_border or current_search_radius >= search_radius:
+            break
+        scored_radius = current_search_radius
+        current_search_radius = min(2 * current_search_radius, search_radius)
+        print(
+            "best shift on the border of the search window, "
+            "increasing search radius to {}".format(current_search_radius)
+        )
 
     # remove padded margin for target
+    target_padded = target
     target = target[
         target_pad_width:-target_pad_width, target_pad_width:-target_pad_width
     ]
@@ -164,6 +917,37 @@ def align(
         )
     )
 
+    refined_shift = None
+    if subpixel_refinement:
+        refined_shift = refine_shift_subpixel(
+            source,
+            target_padded,
+            target_pad_width,
+            best_dx,
+            best_dy,
+            valid_idx=target_valid_idx,
+        )
+    if refined_shift is not None:
+        refined_dx, refined_dy, refined_dz = refined_shift
+        refined_source_shifted = (
+            shift_height_map(
+                source, target_pad_width, refined_dx, refined_dy, (h, w)
+            )
+            + refined_dz
+        )
+        refined_median_err, refined_completeness = calc_score(
+            refined_source_shifted, target
+        )
+        print(
+            "refined dx, dy, dz: {}, {}, {}, refined median err: {}, completeness: {}".format(
+                refined_dx,
+                refined_dy,
+                refined_dz,
+                refined_median_err,
+                refined_completeness,
+            )
+        )
+
     with open(os.path.join(out_dir, "offset.txt"), "w") as fp:
         cell_w, cell_h = cell_physical_size
         fp.write("cell_width (meters): {}\n".format(cell_w))
@@ -173,6 +957,18 @@ def align(
         fp.write("best_dz (meters): {}\n".format(best_dz))
         fp.write("median_err (meters): {}\n".format(median_err))
         fp.write("completeness (<1 meter): {}\n".format(completeness))
+        if refined_shift is not None:
+            fp.write("refined_dx (cells): {}\n".format(refined_dx))
+            fp.write("refined_dy (cells): {}\n".format(refined_dy))
+            fp.write("refined_dz (meters): {}\n".format(refined_dz))
+            fp.write(
+                "refined_median_err (meters): {}\n".format(refined_median_err)
+            )
+            fp.write(
+                "refined_completeness (<1 meter): {}\n".format(
+                    refined_completeness
+                )
+            )
         fp.write(f"median_err_rounded (meters): {median_err:.3f} \n")
         fp.write(f"median_err_rounded (meters): {100 * completeness:.1f} \n")
 
@@ -200,17 +996,76 @@ def align(
     return median_err, completeness
 
 
+def crop_source_height_map(
+    source_tif, source_meta, target_meta, target_pad_width, padded_shape
+):
+    # crop the source images so that it covers the same area as the padded
+    # target (with shape padded_shape), i.e. the padded margin contains the
+    # source values around the target area
+    ul_x = (
+        target_meta["ul_easting"] - source_meta["ul_easting"]
+    ) / source_meta["east_resolution"]
+    ul_y = (
+        source_meta["ul_northing"] - target_meta["ul_northing"]
+    ) / source_meta["north_resolution"]
+    ul_x -= target_pad_width
+    ul_y -= target_pad_width
+    if abs(ul_x - round(ul_x)) < 1e-6 and abs(ul_y - round(ul_y)) < 1e-6:
+        # integer offset: read only the overlapping window (no interpolation)
+        source_crop, _ = read_dsm_tif_window(
+            source_tif,
+            int(round(ul_x)),
+            int(round(ul_y)),
+            padded_shape[1],
+            padded_shape[0],
+        )
+    else:
+        source, _ = read_dsm_tif(source_tif)
+        affine_mat = np.array([[1.0, 0.0, -ul_x], [0.0, 1.0, -ul_y]])
+        source_crop = cv2.warpAffine(
+            source,
+            affine_mat,
+            (padded_shape[1], padded_shape[0]),
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=np.nan,
+        )
+    return source_crop
+
+
 # source_tif is your reconstructed GeoTIFF file
 # target_tif is the ground-truth GeoTIFF file
-def evaluate(source_tif, target_tif, out_dir, max_processes):
+def evaluate(
+    source_tif,
+    target_tif,
+    out_dir,
+    max_processes,
+    search_mode="exhaustive",
+    worker_backend="manager",
+    worker_pool=None,
+    search_radius=30,
+    target_pad_width=None,
+    adaptive_search=False,
+    subpixel_refinement=False,
+    ground_truth_cache=None,
+):
+    # search_radius: maximum shift (in cells) of the alignment, the default
+    #   of 30 cells corresponds to 15 meters
+    # target_pad_width: defaults to search_radius + 10
+    # ground_truth_cache: GroundTruthCache used to load the target_tif (and
+    #   to reuse the padded target and its valid cells for all evaluations
+    #   of the site)
     print(f"evaluating {source_tif}...")
     print(f"(traget_tif: {target_tif})")
 
     if not os.path.exists(out_dir):
         os.mkdir(out_dir)
 
-    source, source_meta = read_dsm_tif(source_tif)
-    target, target_meta = read_dsm_tif(target_tif)
+    source_meta = read_dsm_tif_meta(source_tif)
+    if ground_truth_cache is not None:
+        ground_truth = ground_truth_cache.get(target_tif)
+        target_meta = ground_truth.meta
+    else:
+        target, target_meta = read_dsm_tif(target_tif)
 
     # assert source and target are at the same resolution
     assert np.abs(
@@ -225,34 +1080,26 @@ def evaluate(source_tif, target_tif, out_dir, max_processes):
         target_meta["north_resolution"],
     )
 
-    search_radius = 30  # default is 15 meters search radius
-    target_pad_width = search_radius + 10
-    target = np.pad(
-        target,
-        (
-            (target_pad_width, target_pad_width),
-            (target_pad_width, target_pad_width),
-        ),
-        mode="constant",
-        constant_values=np.nan,
-    )
+    if target_pad_width is None:
+        target_pad_width = search_radius + 10
+    assert 0 < search_radius <= target_pad_width
+    target_valid_idx = None
+    if ground_truth_cache is not None:
+        target = ground_truth.get_padded_target(target_pad_width)
+        target_valid_idx = ground_truth.valid_idx
+    else:
+        target = np.pad(
+            target,
+            (
+                (target_pad_width, target_pad_width),
+                (target_pad_width, target_pad_width),
+            ),
+            mode="constant",
+            constant_values=np.nan,
+        )
 
-    # crop the source images so that it covers the same area as the padded target
-    ul_x = (
-        target_meta["ul_easting"] - source_meta["ul_easting"]
-    ) / source_meta["east_resolution"]
-    ul_y = (
-        source_meta["ul_northing"] - target_meta["ul_northing"]
-    ) / source_meta["north_resolution"]
-    ul_x -= target_pad_width
-    ul_y -= target_pad_width
-    affine_mat = np.array([[1.0, 0.0, -ul_x], [0.0, 1.0, -ul_y]])
-    source_crop = cv2.warpAffine(
-        source,
-        affine_mat,
-        (target.shape[1], target.shape[0]),
-        borderMode=cv2.BORDER_CONSTANT,
-        borderValue=np.nan,
+    source_crop = crop_source_height_map(
+        source_tif, source_meta, target_meta, target_pad_width, target.shape
     )
 
     median_err, completeness = align(
@@ -263,5 +1110,11 @@ def evaluate(source_tif, target_tif, out_dir, max_processes):
         search_radius,
         cell_physical_size,
         max_processes,
+        search_mode=search_mode,
+        worker_backend=worker_backend,
+        worker_pool=worker_pool,
+        adaptive_search=adaptive_search,
+        subpixel_refinement=subpixel_refinement,
+        target_valid_idx=target_valid_idx,
     )
     return median_err, completeness
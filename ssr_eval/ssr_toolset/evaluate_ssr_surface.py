@@ -1,19 +1,24 @@
 import os
 import json
-import numpy as np
 
-from ssr_eval.ext.vissat_toolset_lib.latlon_utm_converter import (
-    latlon_to_eastnorh,
+from ssr_eval.ext.vissat_toolset_lib.enu_utm_transformer import (
+    get_enu_utm_transformer,
 )
-from ssr_eval.ext.vissat_toolset_lib.latlonalt_enu_converter import (
-    enu_to_latlonalt,
+from ssr_eval.ext.vissat_toolset_lib.ply_np_converter import (
+    write_ply_arrays,
+    PlyVertexChunkReader,
+    PlyVertexChunkWriter,
+    transform_vertex_chunks,
 )
 
-# Important: The "evaluate" import MUST BE CALLED BEFORE "Pyntcloud", in order
-# to properly execute "matplotlib.use('Agg')" in "evaluate"
+from ssr_eval.ssr_toolset.align_worker_pool import get_alignment_worker_pool
 from ssr_eval.ssr_toolset.evaluate import evaluate
-from ssr_eval.ssr_toolset.produce_dsm import produce_dsm_from_points
-from pyntcloud import PyntCloud
+from ssr_eval.ssr_toolset.produce_dsm import (
+    produce_dsm_from_points,
+    produce_dsm_from_point_chunks,
+    produce_dsm_from_mesh,
+)
+from ssr_eval.ssr_toolset.utm_point_cache import read_utm_ply_arrays
 
 
 def evaluate_mesh(
@@ -23,7 +28,33 @@ def evaluate_mesh(
     fill_small_holes,
     max_processes=4,
     write_mesh=True,
+    search_mode="exhaustive",
+    worker_backend="manager",
+    worker_pool=None,
+    search_radius=30,
+    target_pad_width=None,
+    adaptive_search=False,
+    subpixel_refinement=False,
+    ground_truth_cache=None,
+    stream_chunk_size=None,
+    dsm_tile_size=None,
+    rasterize_faces=False,
+    dsm_tif_options=None,
+    utm_point_cache=None,
 ):
+    # stream_chunk_size: if not None, the vertices are processed in chunks of
+    #   stream_chunk_size vertices (i.e. they are never loaded completely).
+    #   In this case point_cloud.ply contains only the vertices (and colors).
+    # worker_pool: AlignWorkerPool used to produce the dsm tiles and, if
+    #   worker_backend is "shared_memory", by the alignment
+    # dsm_tile_size: if not None, the dsm is produced in tiles of
+    #   dsm_tile_size x dsm_tile_size cells using the worker_pool
+    # rasterize_faces: if True, the triangles of the mesh are rasterized
+    #   directly into the dsm (no point_cloud.ply is written)
+    # dsm_tif_options: keyword arguments of write_dsm_tif used for dsm.tif
+    #   (e.g. {"compress": "DEFLATE", "tiled": True, "overviews": True})
+    # utm_point_cache: UtmPointCache used to load the (converted) vertices
+    #   (ignored if stream_chunk_size is not None)
     print("Run main_mesh: ...")
 
     if not os.path.exists(out_dir):
@@ -33,56 +64,110 @@ def evaluate_mesh(
     with open(os.path.join(site_data_dir, "aoi.json")) as fp:
         bbx = json.load(fp)
 
-    lat0 = (bbx["lat_min"] + bbx["lat_max"]) / 2.0
-    lon0 = (bbx["lon_min"] + bbx["lon_max"]) / 2.0
-    alt0 = bbx["alt_min"]
-
-    mesh = PyntCloud.from_file(in_ply)
-    mesh_points = mesh.points.loc[:, ["x", "y", "z"]].to_numpy()
-
-    # convert to UTM coordinate system
-    lat, lon, alt = enu_to_latlonalt(
-        mesh_points[:, 0:1],
-        mesh_points[:, 1:2],
-        mesh_points[:, 2:3],
-        lat0,
-        lon0,
-        alt0,
-    )
-    east, north = latlon_to_eastnorh(lat, lon)
-    mesh_points = np.hstack((east, north, alt))
+    # (cached) transformation from ENU to UTM coordinates of the site
+    enu_utm_transformer = get_enu_utm_transformer(site_data_dir)
 
-    # write to ply file
     ply_to_write = os.path.join(out_dir, "point_cloud.ply")
-    print("Writing to {}...".format(ply_to_write))
     comment_1 = "projection: UTM {}{}".format(
         bbx["zone_number"], bbx["hemisphere"]
     )
-
-    also_save = []
-    if write_mesh and hasattr(mesh, "mesh"):
-        also_save.append("mesh")
-    if hasattr(mesh, "comments"):
-        also_save.append("comments")
-    mesh.points.loc[:, ["x", "y", "z"]] = mesh_points
-    mesh.to_file(ply_to_write, also_save=also_save)
-
-    # produce dsm and write to tif file
     mesh_tif_to_write = os.path.join(out_dir, "dsm.tif")
     mesh_jpg_to_write = os.path.join(out_dir, "dsm.jpg")
-    print(f"Writing to {mesh_tif_to_write} and {mesh_jpg_to_write}...")
-    produce_dsm_from_points(
-        bbx,
-        mesh_points,
-        mesh_tif_to_write,
-        mesh_jpg_to_write,
-        fill_small_holes,
-    )
+
+    # loads the vertices and converts them to UTM coordinate system
+    if utm_point_cache is not None:
+        read_utm_arrays = utm_point_cache.get
+    else:
+        read_utm_arrays = read_utm_ply_arrays
+
+    if rasterize_faces:
+        mesh_points, _, mesh_faces, _ = read_utm_arrays(
+            in_ply, site_data_dir, with_color=False, with_faces=True
+        )
+        assert mesh_faces is not None, "No faces found"
+        assert mesh_faces.shape[1] == 3, "Only triangle meshes are supported"
+
+        # rasterize the triangles and write to tif file
+        print(f"Writing to {mesh_tif_to_write} and {mesh_jpg_to_write}...")
+        produce_dsm_from_mesh(
+            bbx,
+            mesh_points,
+            mesh_faces,
+            mesh_tif_to_write,
+            mesh_jpg_to_write,
+            fill_small_holes,
+            tif_options=dsm_tif_options,
+        )
+    elif stream_chunk_size is None:
+        mesh_points, mesh_color, mesh_faces, comments = read_utm_arrays(
+            in_ply, site_data_dir, with_faces=write_mesh
+        )
+
+        # write to ply file
+        print("Writing to {}...".format(ply_to_write))
+        write_ply_arrays(
+            ply_to_write,
+            mesh_points,
+            color=mesh_color,
+            faces=mesh_faces,
+            comments=comments,
+            use_double=True,
+        )
+
+        # produce dsm and write to tif file
+        print(f"Writing to {mesh_tif_to_write} and {mesh_jpg_to_write}...")
+        produce_dsm_from_points(
+            bbx,
+            mesh_points,
+            mesh_tif_to_write,
+            mesh_jpg_to_write,
+            fill_small_holes,
+            tile_size=dsm_tile_size,
+            worker_pool=worker_pool,
+            tif_options=dsm_tif_options,
+        )
+    else:
+        ply_reader = PlyVertexChunkReader(in_ply, stream_chunk_size)
+
+        # write to ply file and produce dsm (chunk by chunk)
+        print("Writing to {}...".format(ply_to_write))
+        print(f"Writing to {mesh_tif_to_write} and {mesh_jpg_to_write}...")
+        with PlyVertexChunkWriter(
+            ply_to_write,
+            ply_reader.num_vertices,
+            with_color=ply_reader.has_color,
+            comments=[
+                comment_1,
+            ],
+            use_double=True,
+        ) as ply_writer:
+            produce_dsm_from_point_chunks(
+                bbx,
+                # convert to UTM coordinate system
+                transform_vertex_chunks(
+                    ply_reader, ply_writer, enu_utm_transformer.enu_to_utm
+                ),
+                mesh_tif_to_write,
+                mesh_jpg_to_write,
+                fill_small_holes,
+                tif_options=dsm_tif_options,
+            )
 
     gt_tif = os.path.join(site_data_dir, "ground_truth.tif")
     print(f"Evaluating {mesh_tif_to_write} with ground-truth {gt_tif}...")
     median_err, completeness = evaluate(
-        mesh_tif_to_write, gt_tif, out_dir, max_processes
+        mesh_tif_to_write,
+        gt_tif,
+        out_dir,
+        max_processes,
+        search_mode=search_mode,
+        worker_backend=worker_backend,
+        worker_pool=get_alignment_worker_pool(worker_pool, worker_backend),
+        search_radius=search_radius,
+        target_pad_width=target_pad_width,
+        adaptive_search=adaptive_search,
+        subpixel_refinement=subpixel_refinement,
+        ground_truth_cache=ground_truth_cache,
     )
     return median_err, completeness
 
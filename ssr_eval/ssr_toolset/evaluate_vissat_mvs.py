@@ -1,22 +1,54 @@
 import os
 import json
-import numpy as np
 
-from ssr_eval.ext.vissat_toolset_lib.ply_np_converter import ply2np, np2ply
-from ssr_eval.ext.vissat_toolset_lib.latlon_utm_converter import (
-    latlon_to_eastnorh,
+from ssr_eval.ext.vissat_toolset_lib.ply_np_converter import (
+    write_ply_arrays,
+    PlyVertexChunkReader,
+    PlyVertexChunkWriter,
+    transform_vertex_chunks,
 )
-from ssr_eval.ext.vissat_toolset_lib.latlonalt_enu_converter import (
-    enu_to_latlonalt,
+from ssr_eval.ext.vissat_toolset_lib.enu_utm_transformer import (
+    get_enu_utm_transformer,
 )
 
+from ssr_eval.ssr_toolset.align_worker_pool import get_alignment_worker_pool
 from ssr_eval.ssr_toolset.evaluate import evaluate
-from ssr_eval.ssr_toolset.produce_dsm import produce_dsm_from_points
+from ssr_eval.ssr_toolset.produce_dsm import (
+    produce_dsm_from_points,
+    produce_dsm_from_point_chunks,
+)
+from ssr_eval.ssr_toolset.utm_point_cache import read_utm_ply_arrays
 
 
 def evaluate_point_cloud(
-    site_data_dir, in_ply, out_dir, fill_small_holes, max_processes=4
+    site_data_dir,
+    in_ply,
+    out_dir,
+    fill_small_holes,
+    max_processes=4,
+    search_mode="exhaustive",
+    worker_backend="manager",
+    worker_pool=None,
+    search_radius=30,
+    target_pad_width=None,
+    adaptive_search=False,
+    subpixel_refinement=False,
+    ground_truth_cache=None,
+    stream_chunk_size=None,
+    dsm_tile_size=None,
+    dsm_tif_options=None,
+    utm_point_cache=None,
 ):
+    # stream_chunk_size: if not None, the point cloud is processed in chunks
+    #   of stream_chunk_size points (i.e. it is never loaded completely)
+    # worker_pool: AlignWorkerPool used to produce the dsm tiles and, if
+    #   worker_backend is "shared_memory", by the alignment
+    # dsm_tile_size: if not None, the dsm is produced in tiles of
+    #   dsm_tile_size x dsm_tile_size cells using the worker_pool
+    # dsm_tif_options: keyword arguments of write_dsm_tif used for dsm.tif
+    #   (e.g. {"compress": "DEFLATE", "tiled": True, "overviews": True})
+    # utm_point_cache: UtmPointCache used to load the (converted) points
+    #   (ignored if stream_chunk_size is not None)
     if not os.path.exists(out_dir):
         os.mkdir(out_dir)
 
@@ -24,48 +56,89 @@ def evaluate_point_cloud(
     with open(os.path.join(site_data_dir, "aoi.json")) as fp:
         bbx = json.load(fp)
 
-    lat0 = (bbx["lat_min"] + bbx["lat_max"]) / 2.0
-    lon0 = (bbx["lon_min"] + bbx["lon_max"]) / 2.0
-    alt0 = bbx["alt_min"]
-
-    # load input ply file
-    points, color, comments = ply2np(in_ply)
-
-    # convert to UTM coordinate system
-    lat, lon, alt = enu_to_latlonalt(
-        points[:, 0:1], points[:, 1:2], points[:, 2:3], lat0, lon0, alt0
-    )
-    east, north = latlon_to_eastnorh(lat, lon)
-    points = np.hstack((east, north, alt))
+    # (cached) transformation from ENU to UTM coordinates of the site
+    enu_utm_transformer = get_enu_utm_transformer(site_data_dir)
 
-    # write to ply file
     ply_to_write = os.path.join(out_dir, "point_cloud.ply")
-    print("Writing to {}...".format(ply_to_write))
     comment_1 = "projection: UTM {}{}".format(
         bbx["zone_number"], bbx["hemisphere"]
     )
-    np2ply(
-        points,
-        ply_to_write,
-        color=color,
-        comments=[
-            comment_1,
-        ],
-        use_double=True,
-    )
-
-    # produce dsm and write to tif file
     tif_to_write = os.path.join(out_dir, "dsm.tif")
     jpg_to_write = os.path.join(out_dir, "dsm.jpg")
-    print("Writing to {} and {}...".format(tif_to_write, jpg_to_write))
-    produce_dsm_from_points(
-        bbx, points, tif_to_write, jpg_to_write, fill_small_holes
-    )
+
+    if stream_chunk_size is None:
+        # load input ply file and convert to UTM coordinate system
+        if utm_point_cache is not None:
+            points, color, _, _ = utm_point_cache.get(in_ply, site_data_dir)
+        else:
+            points, color, _, _ = read_utm_ply_arrays(in_ply, site_data_dir)
+
+        # write to ply file
+        print("Writing to {}...".format(ply_to_write))
+        write_ply_arrays(
+            ply_to_write,
+            points,
+            color=color,
+            comments=[
+                comment_1,
+            ],
+            use_double=True,
+        )
+
+        # produce dsm and write to tif file
+        print("Writing to {} and {}...".format(tif_to_write, jpg_to_write))
+        produce_dsm_from_points(
+            bbx,
+            points,
+            tif_to_write,
+            jpg_to_write,
+            fill_small_holes,
+            tile_size=dsm_tile_size,
+            worker_pool=worker_pool,
+            tif_options=dsm_tif_options,
+        )
+    else:
+        ply_reader = PlyVertexChunkReader(in_ply, stream_chunk_size)
+
+        # write to ply file and produce dsm (chunk by chunk)
+        print("Writing to {}...".format(ply_to_write))
+        print("Writing to {} and {}...".format(tif_to_write, jpg_to_write))
+        with PlyVertexChunkWriter(
+            ply_to_write,
+            ply_reader.num_vertices,
+            with_color=ply_reader.has_color,
+            comments=[
+                comment_1,
+            ],
+            use_double=True,
+        ) as ply_writer:
+            produce_dsm_from_point_chunks(
+                bbx,
+                # convert to UTM coordinate system
+                transform_vertex_chunks(
+                    ply_reader, ply_writer, enu_utm_transformer.enu_to_utm
+                ),
+                tif_to_write,
+                jpg_to_write,
+                fill_small_holes,
+                tif_options=dsm_tif_options,
+            )
 
     tif_gt = os.path.join(site_data_dir, "ground_truth.tif")
     print("Evaluating {} with ground-truth {}...".format(tif_to_write, tif_gt))
     median_err, completeness = evaluate(
-        tif_to_write, tif_gt, out_dir, max_processes
+        tif_to_write,
+        tif_gt,
+        out_dir,
+        max_processes,
+        search_mode=search_mode,
+        worker_backend=worker_backend,
+        worker_pool=get_alignment_worker_pool(worker_pool, worker_backend),
+        search_radius=search_radius,
+        target_pad_width=target_pad_width,
+        adaptive_search=adaptive_search,
+        subpixel_refinement=subpixel_refinement,
+        ground_truth_cache=ground_truth_cache,
     )
     return median_err, completeness
 
@@ -0,0 +1,112 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+from ssr_eval.ext.vissat_toolset_lib.dsm_util import read_dsm_tif
+from ssr_eval.ssr_toolset.shift_scoring import get_valid_index
+
+
+class GroundTruth:
+    """
+    Ground truth height map of a site (nodata cells are nan) together with
+    its meta data (see read_dsm_tif), the flat indices of the valid cells
+    (see get_valid_index) and the nan padded height maps used for the
+    alignment (one per pad width).
+
+    The arrays are shared by all evaluations and must not be modified.
+    """
+
+    def __init__(self, target, meta):
+        self.target = target
+        self.target.flags.writeable = False
+        self.meta = meta
+        self.valid_idx = get_valid_index(target)
+        self.valid_idx.flags.writeable = False
+        self._padded_targets = {}
+
+    def get_padded_target(self, target_pad_width):
+        if target_pad_width not in self._padded_targets:
+            padded_target = np.pad(
+                self.target,
+                (
+                    (target_pad_width, target_pad_width),
+                    (target_pad_width, target_pad_width),
+                ),
+                mode="constant",
+                constant_values=np.nan,
+            )
+            padded_target.flags.writeable = False
+            self._padded_targets[target_pad_width] = padded_target
+        return self._padded_targets[target_pad_width]
+
+
+class GroundTruthCache:
+    """
+    Loads each ground truth tif file only once per run.
+
+    If sidecar_dp is not None, the height map and the meta data are also
+    stored as .npy / .json files in sidecar_dp, which are reused by later
+    runs as long as the modification time of the tif file is unchanged.
+    """
+
+    def __init__(self, sidecar_dp=None):
+        self.sidecar_dp = sidecar_dp
+        self._ground_truths = {}
+
+    def _get_sidecar_fps(self, target_tif):
+        target_tif = os.path.abspath(target_tif)
+        stem = os.path.splitext(os.path.basename(target_tif))[0]
+        path_hash = hashlib.sha1(target_tif.encode("utf-8")).hexdigest()[:8]
+        sidecar_stem = os.path.join(self.sidecar_dp, f"{stem}_{path_hash}")
+        return sidecar_stem + ".npy", sidecar_stem + ".json"
+
+    def _read_sidecar(self, target_tif, target_mtime):
+        npy_fp, json_fp = self._get_sidecar_fps(target_tif)
+        if not (os.path.isfile(npy_fp) and os.path.isfile(json_fp)):
+            return None
+        with open(json_fp) as fp:
+            sidecar = json.load(fp)
+        if sidecar["tif_mtime"] != target_mtime:
+            return None
+        meta = sidecar["meta"]
+        meta["geo"] = tuple(meta["geo"])
+        return np.load(npy_fp), meta
+
+    def _write_sidecar(self, target_tif, target_mtime, target, meta):
+        if not os.path.isdir(self.sidecar_dp):
+            os.makedirs(self.sidecar_dp, exist_ok=True)
+        npy_fp, json_fp = self._get_sidecar_fps(target_tif)
+        # The files are written to temporary files, which are renamed
+        # afterwards (i.e. concurrent processes never read incomplete
+        # files). The json file is renamed last, i.e. it marks a complete
+        # sidecar.
+        temp_fd, temp_fp = tempfile.mkstemp(
+            dir=self.sidecar_dp, prefix=".tmp_", suffix=".npy"
+        )
+        with os.fdopen(temp_fd, "wb") as fp:
+            np.save(fp, target)
+        os.replace(temp_fp, npy_fp)
+        temp_fd, temp_fp = tempfile.mkstemp(
+            dir=self.sidecar_dp, prefix=".tmp_", suffix=".json"
+        )
+        with os.fdopen(temp_fd, "w") as fp:
+            json.dump({"tif_mtime": target_mtime, "meta": meta}, fp)
+        os.replace(temp_fp, json_fp)
+
+    def get(self, target_tif):
+        target_mtime = os.path.getmtime(target_tif)
+        key = (os.path.abspath(target_tif), target_mtime)
+        if key not in self._ground_truths:
+            loaded = None
+            if self.sidecar_dp is not None:
+                loaded = self._read_sidecar(target_tif, target_mtime)
+            if loaded is None:
+                target, meta = read_dsm_tif(target_tif)
+                if self.sidecar_dp is not None:
+                    self._write_sidecar(target_tif, target_mtime, target, meta)
+            else:
+                target, meta = loaded
+            self._ground_truths[key] = GroundTruth(target, meta)
+        return self._ground_truths[key]
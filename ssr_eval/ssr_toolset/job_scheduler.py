@@ -0,0 +1,57 @@
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+
+def split_cpu_budget(max_processes, num_jobs, max_parallel_jobs):
+    # Splits max_processes cores between concurrently running jobs and the
+    # (alignment) worker processes of each job. Returns (num_parallel_jobs,
+    # num_processes_per_job).
+    num_parallel_jobs = max(1, min(max_parallel_jobs, num_jobs, max_processes))
+    num_processes_per_job = max(1, max_processes // num_parallel_jobs)
+    return num_parallel_jobs, num_processes_per_job
+
+
+def _run_job(job_func, args):
+    # Returns (result, None) or (None, error message), i.e. an exception
+    # does not abort the remaining jobs
+    try:
+        return job_func(*args), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def run_jobs(
+    job_func, args_list, num_parallel_jobs, initializer=None, initargs=()
+):
+    """
+    Runs job_func(*args) for each entry of args_list and returns a list of
+    (result, error) pairs in the order of args_list. If a job raises an
+    exception, result is None and error contains the traceback.
+
+    If num_parallel_jobs > 1, the jobs are executed by num_parallel_jobs
+    (non-daemonic) processes, i.e. a job may start its own worker processes.
+    initializer(*initargs) is called once in each of these processes (or
+    once in this process, if the jobs are executed sequentially) and may be
+    used to create state shared by the jobs of a process.
+    """
+    if num_parallel_jobs <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return [_run_job(job_func, args) for args in args_list]
+
+    with ProcessPoolExecutor(
+        max_workers=num_parallel_jobs,
+        initializer=initializer,
+        initargs=initargs,
+    ) as executor:
+        futures = [
+            executor.submit(_run_job, job_func, args) for args in args_list
+        ]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception:
+                # e.g. the process executing the job has been killed
+                results.append((None, traceback.format_exc()))
+        return results
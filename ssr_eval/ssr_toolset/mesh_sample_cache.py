@@ -0,0 +1,108 @@
+import os
+import shutil
+import hashlib
+import tempfile
+
+from ssr_eval.utility.file_hash import get_file_sha1
+
+
+def _link_or_copy(src_fp, dst_fp):
+    # Hard links avoid copying the (large) point clouds, if src_fp and
+    # dst_fp are on the same file system
+    try:
+        os.link(src_fp, dst_fp)
+    except OSError:
+        shutil.copyfile(src_fp, dst_fp)
+
+
+class MeshSampleCache:
+    """
+    Persistent cache of the point clouds sampled from meshes with Meshlab.
+
+    An entry is identified by the hash of the mesh file, the sampling
+    method, the number of samples and the seed, i.e. it is reused by later
+    runs and by the evaluations with different hole filling parameters.
+    Each entry is a ply file in cache_dp, which is linked (or copied) to the
+    requested output path.
+
+    If the entries exceed max_size bytes, the least recently used entries
+    are removed.
+    """
+
+    def __init__(self, cache_dp, max_size=50 * 2**30):
+        self.cache_dp = cache_dp
+        self.max_size = max_size
+
+    def _get_entry_fp(self, mesh_ifp, num_samples, sampling_method, seed):
+        key_str = "_".join(
+            [
+                get_file_sha1(mesh_ifp),
+                sampling_method,
+                str(num_samples),
+                str(seed),
+            ]
+        )
+        key = hashlib.sha1(key_str.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dp, key + ".ply")
+
+    def _write_entry(self, entry_fp, sampled_fp):
+        if not os.path.isdir(self.cache_dp):
+            os.makedirs(self.cache_dp, exist_ok=True)
+        # The entry is written to a temporary file, which is renamed
+        # afterwards (i.e. incomplete entries are never read)
+        temp_fd, temp_fp = tempfile.mkstemp(
+            dir=self.cache_dp, prefix=".tmp_", suffix=".ply"
+        )
+        os.close(temp_fd)
+        shutil.copyfile(sampled_fp, temp_fp)
+        os.replace(temp_fp, entry_fp)
+
+    def _evict(self, keep_fp):
+        entries = []
+        for fn in os.listdir(self.cache_dp):
+            entry_fp = os.path.join(self.cache_dp, fn)
+            if fn.startswith(".tmp_") or not fn.endswith(".ply"):
+                continue
+            stat = os.stat(entry_fp)
+            entries.append((stat.st_mtime, entry_fp, stat.st_size))
+        total_size = sum(size for _, _, size in entries)
+        # remove the least recently used entries first
+        for _, entry_fp, size in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if entry_fp == keep_fp:
+                continue
+            try:
+                os.remove(entry_fp)
+            except FileNotFoundError:
+                # the entry has been removed concurrently
+                pass
+            total_size -= size
+
+    def sample_mesh(
+        self,
+        meshlab,
+        mesh_ifp,
+        sampled_fp,
+        num_samples,
+        sampling_method,
+        seed=0,
+    ):
+        # Writes the samples to sampled_fp (like meshlab.sample_mesh)
+        entry_fp = self._get_entry_fp(
+            mesh_ifp, num_samples, sampling_method, seed
+        )
+        if os.path.isfile(entry_fp):
+            print(f"Using cached samples of {mesh_ifp}...")
+            try:
+                # mark the entry as recently used
+                os.utime(entry_fp)
+                _link_or_copy(entry_fp, sampled_fp)
+                return
+            except FileNotFoundError:
+                # the entry has been evicted concurrently
+                pass
+
+        meshlab.sample_mesh(mesh_ifp, sampled_fp, num_samples, sampling_method)
+        self._write_entry(entry_fp, sampled_fp)
+        self._evict(entry_fp)
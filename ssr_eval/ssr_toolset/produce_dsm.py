@@ -4,16 +4,18 @@ from ssr_eval.ext.vissat_toolset_visualization.plot_height_map import (
     plot_height_map,
 )
 from ssr_eval.ext.vissat_toolset_lib.dsm_util import write_dsm_tif
-from ssr_eval.ssr_toolset.proj_to_grid import proj_to_grid
+from ssr_eval.ssr_toolset.rasterize_mesh import rasterize_triangles
+from ssr_eval.ssr_toolset.proj_to_grid import (
+    proj_to_grid,
+    get_grid_indices,
+    fill_holes_with_median,
+    MaxHeightGrid,
+)
 
 import cv2
 
 
-# points is in the cooridnate system (UTM east, UTM north, altitude)
-def produce_dsm_from_points(
-    bbx, points, tif_to_write, jpg_to_write, fill_small_holes
-):
-    # write dsm to tif
+def _get_dsm_grid(bbx):
     ul_e = bbx["ul_easting"]
     ul_n = bbx["ul_northing"]
 
@@ -21,24 +23,24 @@ def produce_dsm_from_points(
     n_resolution = 0.5
     e_size = int(bbx["width"] / e_resolution) + 1
     n_size = int(bbx["height"] / n_resolution) + 1
-    dsm = proj_to_grid(
-        points,
-        ul_e,
-        ul_n,
-        e_resolution,
-        n_resolution,
-        e_size,
-        n_size,
-        fill_small_holes,
-    )
+    return ul_e, ul_n, e_resolution, n_resolution, e_size, n_size
+
+
+def _write_dsm(bbx, dsm, tif_to_write, jpg_to_write, tif_options=None):
+    # tif_options: keyword arguments of write_dsm_tif (e.g. compress, tiled,
+    #   overviews or cog)
+    if tif_options is None:
+        tif_options = {}
+    ul_e, ul_n, e_resolution, n_resolution, e_size, n_size = _get_dsm_grid(bbx)
     # median filter
-    dsm = cv2.medianBlur(dsm.astype(np.float32), 3)
+    dsm = cv2.medianBlur(dsm.astype(np.float32, copy=False), 3)
     write_dsm_tif(
         dsm,
         tif_to_write,
         (ul_e, ul_n, e_resolution, n_resolution),
         (bbx["zone_number"], bbx["hemisphere"]),
         nodata_val=-9999,
+        **tif_options,
     )
 
     # create a preview file
@@ -47,3 +49,220 @@ def produce_dsm_from_points(
         plot_height_map(dsm, jpg_to_write, save_cbar=True)
 
     return (ul_e, ul_n, e_size, n_size, e_resolution, n_resolution)
+
+
+def _produce_dsm_tile(
+    points_row,
+    points_col,
+    points_val,
+    tile_shape,
+    inner_window,
+    fill_small_holes,
+    dsm_dtype,
+):
+    # Rasterizes and hole-fills a single tile (including its halo cells) and
+    # returns the inner window (without the halo cells)
+    tile_height, tile_width = tile_shape
+    dsm = np.full(tile_height * tile_width, np.nan, dtype=dsm_dtype)
+    # fmax ignores nan values (like nanmax)
+    np.fmax.at(dsm, points_row * tile_width + points_col, points_val)
+    dsm = dsm.reshape(tile_shape)
+    if fill_small_holes:
+        dsm = fill_holes_with_median(dsm, int(fill_small_holes))
+    row_start, row_end, col_start, col_end = inner_window
+    return dsm[row_start:row_end, col_start:col_end]
+
+
+def produce_dsm_tiled(
+    points,
+    xoff,
+    yoff,
+    xresolution,
+    yresolution,
+    xsize,
+    ysize,
+    fill_small_holes,
+    tile_size,
+    dsm_dtype=np.float64,
+    worker_pool=None,
+):
+    """
+    Produces the dsm of proj_to_grid() (i.e. the rasterized and hole-filled
+    dsm) tile by tile.
+
+    The points are bucketed into overlapping tiles of tile_size x tile_size
+    cells plus a halo of fill radius cells on each side, which covers the
+    neighborhoods used by the hole filling. Thus, the stitched dsm is
+    identical to the dsm produced without tiling. The tiles are processed
+    with worker_pool.starmap() (or sequentially, if worker_pool is None).
+
+    The median filter is not applied per tile, since cv2.medianBlur
+    handles nan values depending on the image width (i.e. tiles would not
+    match the same cells of the full grid).
+    """
+    points_group_idx, points_val = get_grid_indices(
+        points, xoff, yoff, xresolution, yresolution, xsize, ysize
+    )
+    points_row, points_col = np.divmod(points_group_idx, xsize)
+    halo = int(fill_small_holes)
+
+    args_list = []
+    tile_windows = []
+    for tile_row in range(0, ysize, tile_size):
+        row_start = max(tile_row - halo, 0)
+        row_end = min(tile_row + tile_size + halo, ysize)
+        row_mask = (points_row >= row_start) & (points_row < row_end)
+        band_row = points_row[row_mask] - row_start
+        band_col = points_col[row_mask]
+        band_val = points_val[row_mask]
+        for tile_col in range(0, xsize, tile_size):
+            col_start = max(tile_col - halo, 0)
+            col_end = min(tile_col + tile_size + halo, xsize)
+            col_mask = (band_col >= col_start) & (band_col < col_end)
+            tile_end_row = min(tile_row + tile_size, ysize)
+            tile_end_col = min(tile_col + tile_size, xsize)
+            inner_window = (
+                tile_row - row_start,
+                tile_end_row - row_start,
+                tile_col - col_start,
+                tile_end_col - col_start,
+            )
+            args_list.append(
+                (
+                    band_row[col_mask],
+                    band_col[col_mask] - col_start,
+                    band_val[col_mask],
+                    (row_end - row_start, col_end - col_start),
+                    inner_window,
+                    fill_small_holes,
+                    dsm_dtype,
+                )
+            )
+            tile_windows.append(
+                (tile_row, tile_end_row, tile_col, tile_end_col)
+            )
+
+    if worker_pool is not None:
+        tiles = worker_pool.starmap(_produce_dsm_tile, args_list)
+    else:
+        tiles = [_produce_dsm_tile(*args) for args in args_list]
+
+    # stitch the tiles
+    dsm = np.empty((ysize, xsize), dtype=dsm_dtype)
+    for tile, (row_start, row_end, col_start, col_end) in zip(
+        tiles, tile_windows
+    ):
+        dsm[row_start:row_end, col_start:col_end] = tile
+    return dsm
+
+
+# points is in the cooridnate system (UTM east, UTM north, altitude)
+def produce_dsm_from_points(
+    bbx,
+    points,
+    tif_to_write,
+    jpg_to_write,
+    fill_small_holes,
+    dsm_dtype=np.float64,
+    tile_size=None,
+    worker_pool=None,
+    tif_options=None,
+):
+    # dsm_dtype: data type used to rasterize the points (the written dsm is
+    #   always float32)
+    # tile_size: if not None, the dsm is produced in tiles of
+    #   tile_size x tile_size cells (see produce_dsm_tiled)
+    # worker_pool: pool (e.g. AlignWorkerPool) used to process the tiles
+    # tif_options: keyword arguments of write_dsm_tif (see _write_dsm)
+
+    # write dsm to tif
+    ul_e, ul_n, e_resolution, n_resolution, e_size, n_size = _get_dsm_grid(bbx)
+    if tile_size is not None:
+        dsm = produce_dsm_tiled(
+            points,
+            ul_e,
+            ul_n,
+            e_resolution,
+            n_resolution,
+            e_size,
+            n_size,
+            fill_small_holes,
+            tile_size,
+            dsm_dtype=dsm_dtype,
+            worker_pool=worker_pool,
+        )
+    else:
+        dsm = proj_to_grid(
+            points,
+            ul_e,
+            ul_n,
+            e_resolution,
+            n_resolution,
+            e_size,
+            n_size,
+            fill_small_holes,
+            dtype=dsm_dtype,
+        )
+    return _write_dsm(
+        bbx, dsm, tif_to_write, jpg_to_write, tif_options=tif_options
+    )
+
+
+# point_chunks is an iterable of point arrays in the cooridnate system
+# (UTM east, UTM north, altitude), which are rasterized one after another
+def produce_dsm_from_point_chunks(
+    bbx,
+    point_chunks,
+    tif_to_write,
+    jpg_to_write,
+    fill_small_holes,
+    dsm_dtype=np.float64,
+    tif_options=None,
+):
+    ul_e, ul_n, e_resolution, n_resolution, e_size, n_size = _get_dsm_grid(bbx)
+    max_height_grid = MaxHeightGrid(
+        ul_e,
+        ul_n,
+        e_resolution,
+        n_resolution,
+        e_size,
+        n_size,
+        dtype=dsm_dtype,
+    )
+    for points in point_chunks:
+        max_height_grid.add_points(points)
+    dsm = max_height_grid.get_dsm(fill_small_holes)
+    return _write_dsm(
+        bbx, dsm, tif_to_write, jpg_to_write, tif_options=tif_options
+    )
+
+
+# vertices is in the cooridnate system (UTM east, UTM north, altitude), faces
+# contains the vertex indices of the triangles
+def produce_dsm_from_mesh(
+    bbx,
+    vertices,
+    faces,
+    tif_to_write,
+    jpg_to_write,
+    fill_small_holes,
+    dsm_dtype=np.float64,
+    tif_options=None,
+):
+    ul_e, ul_n, e_resolution, n_resolution, e_size, n_size = _get_dsm_grid(bbx)
+    dsm = rasterize_triangles(
+        vertices,
+        faces,
+        ul_e,
+        ul_n,
+        e_resolution,
+        n_resolution,
+        e_size,
+        n_size,
+        dtype=dsm_dtype,
+    )
+    if fill_small_holes:
+        dsm = fill_holes_with_median(dsm, int(fill_small_holes))
+    return _write_dsm(
+        bbx, dsm, tif_to_write, jpg_to_write, tif_options=tif_options
+    )
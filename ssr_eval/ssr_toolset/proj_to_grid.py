@@ -2,6 +2,107 @@ import numpy as np
 import numpy_groupies as npg
 
 
+def fill_holes_with_median(dsm, radius=1, max_chunk_size=1000000):
+    """
+    Replace each nan cell with the median of the valid cells in its
+    (2 * radius + 1) x (2 * radius + 1) neighborhood in the input dsm.
+
+    Equivalent to looping over the nan cells and calling np.median on the
+    list of valid neighbors, but processes the nan cells in vectorized
+    chunks of at most max_chunk_size cells.
+    """
+    dsm_filled = dsm.copy()
+    nan_rows, nan_cols = np.nonzero(np.isnan(dsm))
+    dsm_padded = np.pad(dsm, radius, mode="constant", constant_values=np.nan)
+    offsets = range(-radius, radius + 1)
+    num_neighbors = len(offsets) ** 2
+
+    for start in range(0, nan_rows.size, max_chunk_size):
+        rows = nan_rows[start : start + max_chunk_size] + radius
+        cols = nan_cols[start : start + max_chunk_size] + radius
+
+        neighbors = np.empty((rows.size, num_neighbors), dtype=dsm.dtype)
+        neighbor_idx = 0
+        for row_offset in offsets:
+            for col_offset in offsets:
+                neighbors[:, neighbor_idx] = dsm_padded[
+                    rows + row_offset, cols + col_offset
+                ]
+                neighbor_idx += 1
+
+        # nan values are sorted to the end of each row
+        neighbors.sort(axis=1)
+        num_valid = np.count_nonzero(
+            np.logical_not(np.isnan(neighbors)), axis=1
+        )
+        has_valid = num_valid > 0
+        neighbors = neighbors[has_valid]
+        num_valid = num_valid[has_valid]
+        # (lower + upper) / 2 is identical to np.median (for an odd number
+        # of values both indices refer to the same value)
+        chunk_idx = np.arange(neighbors.shape[0])
+        lower = neighbors[chunk_idx, (num_valid - 1) // 2]
+        upper = neighbors[chunk_idx, num_valid // 2]
+        dsm_filled[rows[has_valid] - radius, cols[has_valid] - radius] = (
+            lower + upper
+        ) / 2
+
+    return dsm_filled
+
+
+# Returns the flat grid index and the value of each point within the grid
+def get_grid_indices(
+    points, xoff, yoff, xresolution, yresolution, xsize, ysize
+):
+    row = np.floor((yoff - points[:, 1]) / xresolution).astype(dtype=np.int64)
+    col = np.floor((points[:, 0] - xoff) / yresolution).astype(dtype=np.int64)
+    points_group_idx = row * xsize + col
+    points_val = points[:, 2]
+
+    # remove points that lie out of the dsm boundary
+    mask = ((row >= 0) * (col >= 0) * (row < ysize) * (col < xsize)) > 0
+    points_group_idx = points_group_idx[mask]
+    points_val = points_val[mask]
+    return points_group_idx, points_val
+
+
+class MaxHeightGrid:
+    """
+    Running max-height accumulator, which allows to rasterize point clouds
+    chunk by chunk. The result is identical to proj_to_grid() applied to
+    all points at once, while the memory only depends on the grid size.
+    """
+
+    def __init__(
+        self,
+        xoff,
+        yoff,
+        xresolution,
+        yresolution,
+        xsize,
+        ysize,
+        dtype=np.float64,
+    ):
+        self._grid_params = (xoff, yoff, xresolution, yresolution)
+        self.xsize = xsize
+        self.ysize = ysize
+        self._dsm = np.full(xsize * ysize, np.nan, dtype=dtype)
+
+    def add_points(self, points):
+        # points: each row is (xx, yy, zz)
+        points_group_idx, points_val = get_grid_indices(
+            points, *self._grid_params, self.xsize, self.ysize
+        )
+        # fmax ignores nan values (like nanmax)
+        np.fmax.at(self._dsm, points_group_idx, points_val)
+
+    def get_dsm(self, fill_small_holes):
+        dsm = self._dsm.reshape((self.ysize, self.xsize))
+        if fill_small_holes:
+            dsm = fill_holes_with_median(dsm, int(fill_small_holes))
+        return dsm
+
+
 # # points: each row is (xx, yy, zz)
 # # xoff: ul_e
 # # yoff: ul_n
@@ -14,52 +115,35 @@ def proj_to_grid(
     xsize,
     ysize,
     fill_small_holes,
+    dtype=np.float64,
 ):
-    row = np.floor((yoff - points[:, 1]) / xresolution).astype(dtype=np.int64)
-    col = np.floor((points[:, 0] - xoff) / yresolution).astype(dtype=np.int64)
-    points_group_idx = row * xsize + col
-    points_val = points[:, 2]
-
-    # remove points that lie out of the dsm boundary
-    mask = ((row >= 0) * (col >= 0) * (row < ysize) * (col < xsize)) > 0
-    points_group_idx = points_group_idx[mask]
-    points_val = points_val[mask]
-
-    # create a place holder for all pixels in the dsm
-    group_idx = np.arange(xsize * ysize).astype(dtype=np.int64)
-    group_val = np.empty(xsize * ysize)
-    group_val.fill(np.nan)
-
-    # concatenate place holders with the real valuies, then aggregate
-    group_idx = np.concatenate((group_idx, points_group_idx))
-    group_val = np.concatenate((group_val, points_val))
+    # dtype: data type of the returned dsm, np.float32 halves the memory
+    #   footprint of the grid
+    points_group_idx, points_val = get_grid_indices(
+        points, xoff, yoff, xresolution, yresolution, xsize, ysize
+    )
 
-    dsm = npg.aggregate(group_idx, group_val, func="nanmax", fill_value=np.nan)
+    # aggregate the values directly into a grid with xsize * ysize cells
+    # (cells without points are set to nan)
+    if points_group_idx.size > 0:
+        dsm = npg.aggregate(
+            points_group_idx,
+            points_val,
+            func="nanmax",
+            size=xsize * ysize,
+            fill_value=np.nan,
+            dtype=dtype,
+        )
+    else:
+        dsm = np.full(xsize * ysize, np.nan, dtype=dtype)
     dsm = dsm.reshape((ysize, xsize))
 
     ###########################################################################
     # try to fill very small holes
     if fill_small_holes:
-        dsm_new = dsm.copy()
-        nan_places = np.argwhere(np.isnan(dsm_new))
-        for i in range(nan_places.shape[0]):
-            row = nan_places[i, 0]
-            col = nan_places[i, 1]
-            neighbors = []
-            for j in range(row - 1, row + 2):
-                for k in range(col - 1, col + 2):
-                    if (
-                        j >= 0
-                        and j < dsm_new.shape[0]
-                        and k >= 0
-                        and k < dsm_new.shape[1]
-                    ):
-                        val = dsm_new[j, k]
-                        if not np.isnan(val):
-                            neighbors.append(val)
-
-            if neighbors:
-                dsm[row, col] = np.median(neighbors)
+        # fill_small_holes is either a bool (i.e. a radius of 1) or the
+        # radius of the neighborhood used to fill the holes
+        dsm = fill_holes_with_median(dsm, int(fill_small_holes))
     ###########################################################################
 
     return dsm
@@ -0,0 +1,133 @@
+import numpy as np
+
+
+def _split_by_counts(counts, max_chunk_size):
+    # Yields (start, end) ranges of consecutive entries whose counts sum up
+    # to at most max_chunk_size (or a single entry exceeding it)
+    cum_counts = np.cumsum(counts)
+    num_entries = counts.size
+    start = 0
+    while start < num_entries:
+        offset = cum_counts[start - 1] if start > 0 else 0
+        end = int(
+            np.searchsorted(cum_counts, offset + max_chunk_size, side="right")
+        )
+        end = max(end, start + 1)
+        yield start, end
+        start = end
+
+
+def rasterize_triangles(
+    vertices,
+    faces,
+    xoff,
+    yoff,
+    xresolution,
+    yresolution,
+    xsize,
+    ysize,
+    dtype=np.float64,
+    max_chunk_size=10000000,
+):
+    """
+    Rasterizes a triangle mesh into a max-height z-buffer with
+    xsize * ysize cells (i.e. without sampling the mesh surface).
+
+    Each cell whose center lies within the (x, y) projection of a triangle
+    receives the height of the triangle at the cell center (computed with
+    barycentric coordinates). In addition, each vertex is assigned to the
+    cell containing it (like proj_to_grid). The maximum height is kept for
+    each cell, cells without any triangle or vertex are set to nan.
+
+    The candidate cells (i.e. the cells within the bounding boxes of the
+    triangles) are processed in vectorized chunks of at most max_chunk_size
+    cells.
+
+    vertices: each row is (xx, yy, zz)
+    faces: each row contains the vertex indices of a triangle
+    xoff: ul_e
+    yoff: ul_n
+    """
+    dsm = np.full(xsize * ysize, np.nan, dtype=dtype)
+
+    # continuous grid coordinates (the center of cell (row, col) is located
+    # at (col + 0.5, row + 0.5))
+    vert_col = (vertices[:, 0] - xoff) / xresolution
+    vert_row = (yoff - vertices[:, 1]) / yresolution
+    vert_z = vertices[:, 2]
+
+    tri_col = vert_col[faces]
+    tri_row = vert_row[faces]
+    tri_z = vert_z[faces]
+
+    # range of the cell centers within the bounding box of each triangle
+    col_min = np.ceil(tri_col.min(axis=1) - 0.5).astype(np.int64)
+    col_max = np.floor(tri_col.max(axis=1) - 0.5).astype(np.int64)
+    row_min = np.ceil(tri_row.min(axis=1) - 0.5).astype(np.int64)
+    row_max = np.floor(tri_row.max(axis=1) - 0.5).astype(np.int64)
+    np.clip(col_min, 0, None, out=col_min)
+    np.clip(col_max, None, xsize - 1, out=col_max)
+    np.clip(row_min, 0, None, out=row_min)
+    np.clip(row_max, None, ysize - 1, out=row_max)
+    width = np.maximum(col_max - col_min + 1, 0)
+    height = np.maximum(row_max - row_min + 1, 0)
+    num_cells = width * height
+
+    # denominator of the barycentric coordinates (zero for triangles whose
+    # projection is degenerated, e.g. vertical walls)
+    c0, c1, c2 = tri_col.T
+    r0, r1, r2 = tri_row.T
+    det = (r1 - r2) * (c0 - c2) + (c2 - c1) * (r0 - r2)
+    keep = np.logical_and(num_cells > 0, det != 0)
+    tri_col = tri_col[keep]
+    tri_row = tri_row[keep]
+    tri_z = tri_z[keep]
+    col_min = col_min[keep]
+    row_min = row_min[keep]
+    width = width[keep]
+    num_cells = num_cells[keep]
+    det = det[keep]
+
+    for start, end in _split_by_counts(num_cells, max_chunk_size):
+        chunk_num_cells = num_cells[start:end]
+        tri_idx = np.repeat(np.arange(start, end), chunk_num_cells)
+        # index of each candidate cell within the bounding box of its
+        # triangle
+        cell_offsets = np.cumsum(chunk_num_cells) - chunk_num_cells
+        local_idx = np.arange(tri_idx.size) - np.repeat(
+            cell_offsets, chunk_num_cells
+        )
+        tri_width = width[tri_idx]
+        cell_row = row_min[tri_idx] + local_idx // tri_width
+        cell_col = col_min[tri_idx] + local_idx % tri_width
+        center_row = cell_row + 0.5
+        center_col = cell_col + 0.5
+
+        c0, c1, c2 = tri_col[tri_idx].T
+        r0, r1, r2 = tri_row[tri_idx].T
+        tri_det = det[tri_idx]
+        dc = center_col - c2
+        dr = center_row - r2
+        l0 = ((r1 - r2) * dc + (c2 - c1) * dr) / tri_det
+        l1 = ((r2 - r0) * dc + (c0 - c2) * dr) / tri_det
+        l2 = 1 - l0 - l1
+        inside = (l0 >= 0) & (l1 >= 0) & (l2 >= 0)
+
+        z0, z1, z2 = tri_z[tri_idx[inside]].T
+        cell_z = l0[inside] * z0 + l1[inside] * z1 + l2[inside] * z2
+        cell_idx = cell_row[inside] * xsize + cell_col[inside]
+        # fmax ignores nan values (like nanmax)
+        np.fmax.at(dsm, cell_idx, cell_z)
+
+    # add the vertices (covers triangles smaller than a cell)
+    vert_row = np.floor(vert_row).astype(np.int64)
+    vert_col = np.floor(vert_col).astype(np.int64)
+    mask = (
+        (vert_row >= 0)
+        & (vert_col >= 0)
+        & (vert_row < ysize)
+        & (vert_col < xsize)
+    )
+    np.fmax.at(dsm, vert_row[mask] * xsize + vert_col[mask], vert_z[mask])
+
+    return dsm.reshape((ysize, xsize))
@@ -0,0 +1,70 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class SharedRaster:
+    """
+    Numpy array backed by a multiprocessing.shared_memory block.
+
+    The process that creates the raster owns the memory block and is
+    responsible for calling unlink() (or using the raster as context
+    manager). Worker processes only receive the (picklable) spec and attach
+    to the same block with SharedRaster.attach(), i.e. the raster data is
+    never copied into the workers.
+    """
+
+    def __init__(self, shm, shape, dtype, owner):
+        self._shm = shm
+        self._owner = owner
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+
+    @classmethod
+    def create_empty(cls, shape, dtype, fill_value=None):
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        raster = cls(shm, shape, dtype, owner=True)
+        if fill_value is not None:
+            raster.array.fill(fill_value)
+        return raster
+
+    @classmethod
+    def create_from_array(cls, array):
+        raster = cls.create_empty(array.shape, array.dtype)
+        raster.array[...] = array
+        return raster
+
+    @classmethod
+    def attach(cls, spec, read_only=True):
+        name, shape, dtype_str = spec
+        shm = shared_memory.SharedMemory(name=name)
+        raster = cls(shm, shape, dtype_str, owner=False)
+        if read_only:
+            raster.array.flags.writeable = False
+        return raster
+
+    @property
+    def spec(self):
+        # picklable description used by worker processes to attach
+        return self._shm.name, self.shape, self.dtype.str
+
+    def close(self):
+        # the array must be released before the buffer can be closed
+        self.array = None
+        self._shm.close()
+
+    def unlink(self):
+        self.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._owner:
+            self.unlink()
+        else:
+            self.close()
@@ -0,0 +1,136 @@
+import numpy as np
+
+# np.take converts int32 indices to intp, i.e. the source cells are gathered
+# in chunks to bound the size of the converted index array
+_GATHER_CHUNK_SIZE = 2**18
+
+
+def _median_inplace(values, num_valid):
+    # Same result as np.nanmedian(values), where values contains num_valid
+    # valid entries. values are partitioned in place (i.e. no copy is
+    # created), nan values are sorted to the end by the partition.
+    half = num_valid // 2
+    if num_valid % 2 == 1:
+        values.partition(half)
+        return np.mean(values[half : half + 1])
+    else:
+        values.partition((half - 1, half))
+        return np.mean(values[half - 1 : half + 1])
+
+
+def get_index_dtype(size):
+    # smallest integer type for flat indices of an array with size entries
+    if size <= np.iinfo(np.int32).max:
+        return np.int32
+    return np.int64
+
+
+def get_valid_index(height_map):
+    # flat indices of the valid (not nan) cells of a 2D height map
+    valid_idx = np.flatnonzero(np.logical_not(np.isnan(height_map)))
+    return valid_idx.astype(get_index_dtype(height_map.size), copy=False)
+
+
+class ShiftScorer:
+    """
+    Computes the median dz and the median absolute error of (dx, dy) shifts
+    of a (padded) source height map w.r.t. a (padded) target height map.
+
+    The flat indices of the valid target cells are computed once (or passed
+    as valid_idx, see get_valid_index() of the unpadded target). For each
+    shift only the corresponding source cells are gathered and the medians
+    are computed with partition based selection (invalid source cells
+    become nan and are sorted to the end, i.e. no compaction is required).
+    The gather buffer, a nan mask and one work array are preallocated and
+    reused between the shifts, i.e. a float32 raster requires 17 bytes per
+    valid target cell (including the int32 indices and the target values).
+
+    With cell_stride > 1 only every cell_stride-th valid target cell is
+    used, which yields a cheap estimate of the scores.
+
+    For cell_stride == 1 the results are identical to
+        median_dz = np.nanmedian(target - source_shifted)
+        median_err = np.nanmedian(np.abs(source_shifted + median_dz - target))
+    """
+
+    def __init__(
+        self, source, target, target_pad_width, cell_stride=1, valid_idx=None
+    ):
+        self._pad_width = target_pad_width
+        self._source_flat = np.ascontiguousarray(source).reshape(-1)
+        source_width = source.shape[1]
+        self._source_width = source_width
+
+        target = target[
+            target_pad_width:-target_pad_width,
+            target_pad_width:-target_pad_width,
+        ]
+        if valid_idx is None:
+            valid_idx = get_valid_index(target)
+        valid_idx = valid_idx[::cell_stride]
+        index_dtype = get_index_dtype(self._source_flat.size)
+        rows, cols = np.divmod(
+            valid_idx.astype(index_dtype, copy=False),
+            index_dtype(target.shape[1]),
+        )
+        self._target_vals = np.ascontiguousarray(target[rows, cols])
+        # flat index of the source cell corresponding to each valid target
+        # cell relative to the upper left cell of the shifted source window
+        self._base_idx = rows
+        self._base_idx *= source_width
+        self._base_idx += cols
+        del rows, cols
+
+        num_valid = self._target_vals.size
+        dtype = np.result_type(self._source_flat, self._target_vals)
+        self._source_buf = np.empty(num_valid, dtype=self._source_flat.dtype)
+        self._nan_buf = np.empty(num_valid, dtype=bool)
+        self._work_buf = np.empty(num_valid, dtype=dtype)
+
+    @property
+    def num_valid_target_cells(self):
+        return self._target_vals.size
+
+    def score(self, dx, dy):
+        assert abs(dx) <= self._pad_width and abs(dy) <= self._pad_width
+        window_start = (self._pad_width + dy) * self._source_width + (
+            self._pad_width + dx
+        )
+        source_window = self._source_flat[window_start:]
+        for start in range(0, self._base_idx.size, _GATHER_CHUNK_SIZE):
+            end = start + _GATHER_CHUNK_SIZE
+            np.take(
+                source_window,
+                self._base_idx[start:end],
+                out=self._source_buf[start:end],
+                mode="clip",
+            )
+
+        np.isnan(self._source_buf, out=self._nan_buf)
+        num_pairs = self._source_buf.size - int(
+            np.count_nonzero(self._nan_buf)
+        )
+        if num_pairs == 0:
+            return np.nan, np.nan
+        work = self._work_buf
+
+        # shift source in z direction and compute median error (pairs with
+        # an invalid source cell are nan)
+        np.subtract(self._target_vals, self._source_buf, out=work)
+        median_dz = _median_inplace(work, num_pairs)
+        np.add(self._source_buf, median_dz, out=work)
+        np.subtract(work, self._target_vals, out=work)
+        np.abs(work, out=work)
+        median_err = _median_inplace(work, num_pairs)
+        return median_dz, median_err
+
+
+def score_shift_candidates(source, target, target_pad_width, xy_candi_shifts):
+    # Returns an array with one (median_dz, median_err) row per shift
+    scorer = ShiftScorer(source, target, target_pad_width)
+    scores = np.empty(
+        (len(xy_candi_shifts), 2), dtype=np.result_type(source, target)
+    )
+    for idx, (dx, dy) in enumerate(xy_candi_shifts):
+        scores[idx] = scorer.score(dx, dy)
+    return scores
@@ -0,0 +1,138 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+from ssr_eval.ext.vissat_toolset_lib.ply_np_converter import read_ply_arrays
+from ssr_eval.ext.vissat_toolset_lib.enu_utm_transformer import (
+    get_enu_utm_transformer,
+)
+from ssr_eval.utility.file_hash import get_file_sha1
+
+# Increase, if the stored arrays change (e.g. a different transformation)
+_CACHE_VERSION = 1
+
+
+def read_utm_ply_arrays(
+    in_ply, site_data_dir, with_color=True, with_faces=False
+):
+    # Like read_ply_arrays, but xyz is converted from the ENU coordinates of
+    # the site to (UTM east, UTM north, altitude)
+    xyz, color, faces, comments = read_ply_arrays(
+        in_ply, with_color=with_color, with_faces=with_faces
+    )
+    xyz = get_enu_utm_transformer(site_data_dir).enu_to_utm(xyz)
+    return xyz, color, faces, comments
+
+
+def _get_dir_size(dp):
+    return sum(os.path.getsize(os.path.join(dp, fn)) for fn in os.listdir(dp))
+
+
+class UtmPointCache:
+    """
+    Content addressed cache of the arrays returned by read_utm_ply_arrays.
+
+    An entry is identified by the hash of the ply file, the content of the
+    aoi.json file of the site and the requested arrays, i.e. it is reused
+    for the same input regardless of its path or of the evaluation
+    parameters. Each entry is a directory in cache_dp containing .npy files,
+    which are loaded memory mapped (read-only).
+
+    If the entries exceed max_size bytes, the least recently used entries
+    are removed.
+    """
+
+    def __init__(self, cache_dp, max_size=10 * 2**30):
+        self.cache_dp = cache_dp
+        self.max_size = max_size
+
+    def _get_entry_key(self, in_ply, site_data_dir, with_color, with_faces):
+        with open(os.path.join(site_data_dir, "aoi.json"), "rb") as fp:
+            aoi_bytes = fp.read()
+        key_str = "_".join(
+            [
+                get_file_sha1(in_ply),
+                hashlib.sha1(aoi_bytes).hexdigest(),
+                str(_CACHE_VERSION),
+                str(int(with_color)),
+                str(int(with_faces)),
+            ]
+        )
+        return hashlib.sha1(key_str.encode("utf-8")).hexdigest()
+
+    def _read_entry(self, entry_dp):
+        with open(os.path.join(entry_dp, "entry.json")) as fp:
+            entry = json.load(fp)
+        arrays = {}
+        for name in ["xyz", "color", "faces"]:
+            if entry[f"has_{name}"]:
+                npy_fp = os.path.join(entry_dp, f"{name}.npy")
+                arrays[name] = np.load(npy_fp, mmap_mode="r")
+            else:
+                arrays[name] = None
+        # mark the entry as recently used
+        os.utime(os.path.join(entry_dp, "entry.json"))
+        comments = entry["comments"]
+        return arrays["xyz"], arrays["color"], arrays["faces"], comments
+
+    def _write_entry(self, entry_dp, xyz, color, faces, comments):
+        if not os.path.isdir(self.cache_dp):
+            os.makedirs(self.cache_dp, exist_ok=True)
+        # The entry is written to a temporary directory, which is renamed
+        # afterwards (i.e. incomplete entries are never read)
+        temp_dp = tempfile.mkdtemp(dir=self.cache_dp, prefix=".tmp_")
+        entry = {"comments": comments}
+        for name, array in [("xyz", xyz), ("color", color), ("faces", faces)]:
+            entry[f"has_{name}"] = array is not None
+            if array is not None:
+                np.save(os.path.join(temp_dp, f"{name}.npy"), array)
+        with open(os.path.join(temp_dp, "entry.json"), "w") as fp:
+            json.dump(entry, fp)
+        try:
+            os.rename(temp_dp, entry_dp)
+        except OSError:
+            # the entry has been written concurrently
+            shutil.rmtree(temp_dp, ignore_errors=True)
+
+    def _evict(self, keep_dp):
+        entries = []
+        for dn in os.listdir(self.cache_dp):
+            entry_dp = os.path.join(self.cache_dp, dn)
+            entry_fp = os.path.join(entry_dp, "entry.json")
+            if dn.startswith(".tmp_") or not os.path.isfile(entry_fp):
+                continue
+            entries.append(
+                (os.path.getmtime(entry_fp), entry_dp, _get_dir_size(entry_dp))
+            )
+        total_size = sum(size for _, _, size in entries)
+        # remove the least recently used entries first
+        for _, entry_dp, size in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if entry_dp == keep_dp:
+                continue
+            shutil.rmtree(entry_dp, ignore_errors=True)
+            total_size -= size
+
+    def get(self, in_ply, site_data_dir, with_color=True, with_faces=False):
+        key = self._get_entry_key(
+            in_ply, site_data_dir, with_color, with_faces
+        )
+        entry_dp = os.path.join(self.cache_dp, key)
+        if os.path.isdir(entry_dp):
+            print(f"Loading cached UTM points of {in_ply}...")
+            try:
+                return self._read_entry(entry_dp)
+            except FileNotFoundError:
+                # the entry has been evicted concurrently
+                pass
+
+        xyz, color, faces, comments = read_utm_ply_arrays(
+            in_ply, site_data_dir, with_color=with_color, with_faces=with_faces
+        )
+        self._write_entry(entry_dp, xyz, color, faces, comments)
+        self._evict(entry_dp)
+        return xyz, color, faces, comments
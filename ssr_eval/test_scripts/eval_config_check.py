@@ -0,0 +1,58 @@
+import os
+import toml
+from pydantic import ValidationError
+from ssr_eval.config.eval_config import EvalConfig
+from ssr_eval.ext.vissat_toolset_lib.dsm_util import get_tif_creation_options
+
+_TEMPLATE_FP = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "configs",
+    "eval_template.toml",
+)
+
+
+def eval_config_check(template_fp=_TEMPLATE_FP):
+    # Parses the template with the dsm_tif_options values documented in it
+    # and checks that the values keep their types (e.g. bigtiff = "YES"
+    # must not be converted to a bool)
+    config_dict = toml.load(template_fp)
+    EvalConfig(**config_dict)
+
+    tif_options_list = [
+        {},
+        {"compress": "DEFLATE", "tiled": True, "overviews": True},
+        {"tiled": True, "block_size": 512, "cog": True},
+    ]
+    for compress in ["DEFLATE", "LZW", "ZSTD"]:
+        tif_options_list.append({"compress": compress})
+    for bigtiff in ["YES", "NO", "IF_NEEDED", "IF_SAFER"]:
+        tif_options_list.append({"bigtiff": bigtiff})
+
+    for tif_options in tif_options_list:
+        config = EvalConfig(**{**config_dict, "dsm_tif_options": tif_options})
+        parsed_options = config.dsm_tif_options.dict()
+        for key, value in tif_options.items():
+            assert parsed_options[key] == value, (key, parsed_options[key])
+            assert type(parsed_options[key]) is type(value), key
+        # the keyword arguments of write_dsm_tif, which are used to create
+        # the tif creation options
+        get_tif_creation_options(
+            tiled=parsed_options["tiled"],
+            block_size=parsed_options["block_size"],
+            compress=parsed_options["compress"],
+            bigtiff=parsed_options["bigtiff"],
+        )
+
+    # misspelled options are rejected
+    try:
+        EvalConfig(**{**config_dict, "dsm_tif_options": {"compres": "LZW"}})
+    except ValidationError:
+        pass
+    else:
+        assert False, "unknown dsm_tif_options key has been accepted"
+    print(f"{len(tif_options_list)} dsm_tif_options parsed correctly")
+
+
+if __name__ == "__main__":
+
+    eval_config_check()
@@ -0,0 +1,108 @@
+import time
+import numpy as np
+from ssr_eval.ext.vissat_toolset_lib.dsm_util import (
+    read_dsm_tif,
+    read_dsm_tif_meta,
+)
+from ssr_eval.ssr_toolset.evaluate import (
+    crop_source_height_map,
+    search_best_shift,
+)
+
+
+def read_alignment_height_maps(source_tif, target_tif, target_pad_width):
+    # Returns the padded source and target height maps like evaluate(), i.e.
+    # the padded margin of the source contains the source values around
+    # the target area (only the target is padded with nan)
+    target, target_meta = read_dsm_tif(target_tif)
+    pad_width = ((target_pad_width, target_pad_width),) * 2
+    target = np.pad(target, pad_width, constant_values=np.nan)
+    source = crop_source_height_map(
+        source_tif,
+        read_dsm_tif_meta(source_tif),
+        target_meta,
+        target_pad_width,
+        target.shape,
+    )
+    return source, target
+
+
+def compare_search_mode(
+    source,
+    target,
+    target_pad_width,
+    search_radius,
+    search_mode,
+    max_processes=4,
+):
+    # source and target are the padded height maps (see align()). Raises an
+    # AssertionError, if search_mode ("pyramid" or "pruned") finds another
+    # shift than the exhaustive search.
+    start = time.time()
+    exhaustive_result = search_best_shift(
+        source,
+        target,
+        target_pad_width,
+        search_radius,
+        max_processes,
+        worker_backend="shared_memory",
+    )
+    exhaustive_time = time.time() - start
+
+    start = time.time()
+    result = search_best_shift(
+        source,
+        target,
+        target_pad_width,
+        search_radius,
+        max_processes,
+        search_mode=search_mode,
+        worker_backend="shared_memory",
+    )
+    search_time = time.time() - start
+
+    identical = np.array_equal(
+        np.array(exhaustive_result, dtype=np.float64),
+        np.array(result, dtype=np.float64),
+        equal_nan=True,
+    )
+    print(f"exhaustive (dx, dy, dz, err): {exhaustive_result}")
+    print(f"{search_mode} (dx, dy, dz, err): {result}")
+    print(f"identical: {identical}")
+    print(f"exhaustive: {exhaustive_time:.3f}s")
+    print(f"{search_mode}: {search_time:.3f}s")
+    assert result[:2] == exhaustive_result[:2], (
+        f"{search_mode} search found shift {result[:2]}, the exhaustive "
+        f"search found {exhaustive_result[:2]}"
+    )
+    return identical
+
+
+def search_mode_comparison(
+    source_tif,
+    target_tif,
+    target_pad_width=40,
+    search_radius=30,
+    max_processes=4,
+):
+    # e.g. dsm.tif of an evaluated mesh and the corresponding
+    # ground_truth.tif (the source should cover the padded target area)
+    source, target = read_alignment_height_maps(
+        source_tif, target_tif, target_pad_width
+    )
+    for search_mode in ["pyramid", "pruned"]:
+        compare_search_mode(
+            source,
+            target,
+            target_pad_width,
+            search_radius,
+            search_mode,
+            max_processes,
+        )
+
+
+if __name__ == "__main__":
+
+    source_tif = "/path/to/evaluation/mesh_sm_poisson_disk/dsm.tif"
+    target_tif = "/path/to/VisSatDataset/site1/ground_truth.tif"
+    search_mode_comparison(source_tif, target_tif)
@@ -0,0 +1,72 @@
+import time
+import numpy as np
+from ssr_eval.ext.vissat_toolset_lib.dsm_util import read_dsm_tif
+from ssr_eval.ssr_toolset.shift_scoring import (
+    ShiftScorer,
+    score_shift_candidates,
+)
+
+
+def score_shift_reference(source, target, target_pad_width, dx, dy):
+    # Straightforward (allocating) implementation of ShiftScorer.score()
+    target = target[
+        target_pad_width:-target_pad_width, target_pad_width:-target_pad_width
+    ]
+    h, w = target.shape[:2]
+    ul_x = target_pad_width + dx
+    ul_y = target_pad_width + dy
+    source_shifted = source[ul_y : ul_y + h, ul_x : ul_x + w]
+
+    median_dz = np.nanmedian(target - source_shifted)
+    source_shifted = source_shifted + median_dz
+    median_err = np.nanmedian(np.abs(source_shifted - target))
+    return median_dz, median_err
+
+
+def shift_scoring_benchmark(
+    source_tif, target_tif, target_pad_width=40, search_radius=3
+):
+    # source_tif and target_tif must cover the same area (e.g. dsm.tif of an
+    # evaluated mesh and the corresponding ground_truth.tif)
+    source, _ = read_dsm_tif(source_tif)
+    target, _ = read_dsm_tif(target_tif)
+    pad_width = ((target_pad_width, target_pad_width),) * 2
+    source = np.pad(source, pad_width, constant_values=np.nan)
+    target = np.pad(target, pad_width, constant_values=np.nan)
+
+    xy_candi_shifts = [
+        (dx, dy)
+        for dx in range(-search_radius, search_radius + 1)
+        for dy in range(-search_radius, search_radius + 1)
+    ]
+
+    start = time.time()
+    reference_scores = np.array(
+        [
+            score_shift_reference(source, target, target_pad_width, dx, dy)
+            for dx, dy in xy_candi_shifts
+        ]
+    )
+    reference_time = time.time() - start
+
+    start = time.time()
+    scores = score_shift_candidates(
+        source, target, target_pad_width, xy_candi_shifts
+    )
+    scorer_time = time.time() - start
+
+    assert np.array_equal(reference_scores, scores, equal_nan=True)
+    num_valid = ShiftScorer(
+        source, target, target_pad_width
+    ).num_valid_target_cells
+    print(f"valid target cells: {num_valid}")
+    print(f"candidates: {len(xy_candi_shifts)}")
+    print(f"reference: {reference_time:.3f}s")
+    print(f"shift scorer: {scorer_time:.3f}s")
+
+
+if __name__ == "__main__":
+
+    source_tif = "/path/to/evaluation/mesh_sm_poisson_disk/dsm.tif"
+    target_tif = "/path/to/VisSatDataset/site1/ground_truth.tif"
+    shift_scoring_benchmark(source_tif, target_tif)
@@ -1,49 +1,22 @@
 import os
-import json
-import numpy as np
 from pyntcloud import PyntCloud
 
-from ssr_eval.ext.vissat_toolset_lib.latlon_utm_converter import (
-    latlon_to_eastnorh,
-    eastnorth_to_latlon,
-)
-from ssr_eval.ext.vissat_toolset_lib.latlonalt_enu_converter import (
-    enu_to_latlonalt,
-    latlonalt_to_enu,
+from ssr_eval.ext.vissat_toolset_lib.enu_utm_transformer import (
+    get_enu_utm_transformer,
 )
 
 
 def enu_to_eastnorth(site_data_dir, in_ply, transformed_ply):
 
     print("enu_to_eastnorth: ...")
-    # load aoi.json from the site_data_dir
-    with open(os.path.join(site_data_dir, "aoi.json")) as fp:
-        bbx = json.load(fp)
-
-    lat0 = (bbx["lat_min"] + bbx["lat_max"]) / 2.0
-    lon0 = (bbx["lon_min"] + bbx["lon_max"]) / 2.0
-    alt0 = bbx["alt_min"]
+    # uses the aoi.json from the site_data_dir
+    enu_utm_transformer = get_enu_utm_transformer(site_data_dir)
 
     mesh = PyntCloud.from_file(in_ply)
     points = mesh.points.loc[:, ["x", "y", "z"]].to_numpy()
 
     # convert to UTM coordinate system
-    e = points[:, 0:1]
-    n = points[:, 1:2]
-    u = points[:, 2:3]
-
-    lat, lon, alt = enu_to_latlonalt(e, n, u, lat0, lon0, alt0)
-    east, north = latlon_to_eastnorh(lat, lon)
-    points = np.hstack((east, north, alt))
-
-    # print("e", e)
-    # print("n", n)
-    # print("u", u)
-    # print("lat", lat)
-    # print("lon", lon)
-    # print("alt", alt)
-    # print("east", east)
-    # print("north", north)
+    points = enu_utm_transformer.enu_to_utm(points)
 
     also_save = []
     if hasattr(mesh, "mesh"):
@@ -60,34 +33,13 @@ def eastnorth_to_enu(site_data_dir, transformed_ply, back_transformed_ply):
 
     print("eastnorth_to_enu: ...")
 
-    # load aoi.json from the site_data_dir
-    with open(os.path.join(site_data_dir, "aoi.json")) as fp:
-        bbx = json.load(fp)
-
-    lat0 = (bbx["lat_min"] + bbx["lat_max"]) / 2.0
-    lon0 = (bbx["lon_min"] + bbx["lon_max"]) / 2.0
-    alt0 = bbx["alt_min"]
-    zone_number = bbx["zone_number"]
-    hemisphere = bbx["hemisphere"]
+    # uses the aoi.json from the site_data_dir
+    enu_utm_transformer = get_enu_utm_transformer(site_data_dir)
 
     mesh = PyntCloud.from_file(transformed_ply)
     points = mesh.points.loc[:, ["x", "y", "z"]].to_numpy()
-    east = points[:, 0:1]
-    north = points[:, 1:2]
-    alt = points[:, 2:3]
     # convert back to enu coordinates
-    lat, lon = eastnorth_to_latlon(east, north, zone_number, hemisphere)
-    e, n, u = latlonalt_to_enu(lat, lon, alt, lat0, lon0, alt0)
-    points = np.hstack((e, n, u))
-
-    # print("e", e)
-    # print("n", n)
-    # print("u", u)
-    # print("lat", lat)
-    # print("lon", lon)
-    # print("alt", alt)
-    # print("east", east)
-    # print("north", north)
+    points = enu_utm_transformer.utm_to_enu(points)
 
     also_save = []
     if hasattr(mesh, "mesh"):
@@ -0,0 +1,54 @@
+import os
+import json
+
+from ssr_eval.utility.file_hash import get_file_sha1
+
+# Increase, if the computation of the results changes (i.e. the results of
+# previous versions become stale)
+EVAL_CODE_VERSION = 1
+
+MANIFEST_FN = "manifest.json"
+
+
+def get_evaluation_fingerprint(
+    mesh_ifp, ground_truth_ifp, sampling_method, fill_small_holes, settings
+):
+    # settings: dict of further (json serializable) parameters affecting the
+    #   results (e.g. the number of samples or the alignment parameters)
+    return {
+        "mesh_sha1": get_file_sha1(mesh_ifp),
+        "ground_truth_sha1": get_file_sha1(ground_truth_ifp),
+        "sampling_method": sampling_method,
+        "fill_small_holes": fill_small_holes,
+        "code_version": EVAL_CODE_VERSION,
+        "settings": settings,
+    }
+
+
+def read_manifest(odp):
+    manifest_fp = os.path.join(odp, MANIFEST_FN)
+    if not os.path.isfile(manifest_fp):
+        return None
+    with open(manifest_fp) as fp:
+        return json.load(fp)
+
+
+def write_manifest(odp, fingerprint, metrics):
+    # The manifest is written after all other results (and renamed), i.e. it
+    # only exists for complete evaluations
+    manifest_fp = os.path.join(odp, MANIFEST_FN)
+    with open(manifest_fp + ".tmp", "w") as fp:
+        json.dump(
+            {"fingerprint": fingerprint, "metrics": metrics}, fp, indent=4
+        )
+    os.replace(manifest_fp + ".tmp", manifest_fp)
+
+
+def is_up_to_date(odp, fingerprint):
+    # True, if odp contains the complete results for the given fingerprint
+    manifest = read_manifest(odp)
+    if manifest is None:
+        return False
+    # json.load returns the same types for the (json serializable)
+    # fingerprint values
+    return manifest["fingerprint"] == fingerprint
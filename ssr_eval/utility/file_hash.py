@@ -0,0 +1,19 @@
+import os
+import hashlib
+import functools
+
+
+@functools.lru_cache(maxsize=64)
+def _get_file_sha1(fp, file_size, file_mtime_ns, chunk_size=2**20):
+    sha1 = hashlib.sha1()
+    with open(fp, "rb") as stream:
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_file_sha1(fp):
+    # The hash of each file is computed only once per process (as long as
+    # its size and modification time are unchanged)
+    stat = os.stat(fp)
+    return _get_file_sha1(os.path.abspath(fp), stat.st_size, stat.st_mtime_ns)